@@ -28,6 +28,10 @@
 // Deep sleep duration (microseconds) - 1 hour
 #define DEEP_SLEEP_DURATION 3600000000ULL  // 1 hour in microseconds
 
+// Longest sleep (seconds) taken from the server's X-Sleep-Hint (time until the next power
+// change or expected schedule update). Set to 3600 to still redraw the current hour marker hourly
+#define MAX_SLEEP_HINT 10800
+
 // -------------
 
 #include <WiFi.h>
@@ -59,6 +63,7 @@ void syncTime();
 String getFormattedTime();
 int getCurrentHour();
 uint64_t calculateSleepUntilNextHour();
+uint64_t calculateSleepDuration();
 float readBatteryVoltage();
 String getFormattedBatteryVoltage();
 String getCachedBatteryVoltage();
@@ -66,6 +71,14 @@ String getCachedBatteryVoltage();
 // Cached readings captured before WiFi to avoid ADC2 + WiFi conflicts on S3
 static String g_cachedBatteryStr = "";
 
+// Last good API response, kept in RTC memory across deep sleep.
+// Sent back as If-None-Match so an unchanged schedule costs a bodiless 304.
+RTC_DATA_ATTR static char g_etag[48] = "";
+RTC_DATA_ATTR static char g_payload[1024] = "";
+
+// X-Sleep-Hint of this wake's response in seconds, 0 if there was none
+static long g_sleepHint = 0;
+
 void setup() {
     // Set ADC resolution to 12 bits
     analogReadResolution(12);
@@ -142,13 +155,13 @@ void setup() {
     // Configure hardware for low-power (required for 18uA deep sleep current)
     Platform::prepareToSleep();
     
-    // Calculate dynamic sleep duration until next hour boundary (00:00:30)
-    uint64_t sleep_duration = calculateSleepUntilNextHour();
+    // Sleep until the next power change or schedule update (server hint), else the next hour boundary
+    uint64_t sleep_duration = calculateSleepDuration();
     
-    // Configure deep sleep to wake up at next hour boundary
+    // Configure deep sleep to wake up then
     esp_sleep_enable_timer_wakeup(sleep_duration);
     
-    // Enter deep sleep - device will restart at next hour boundary and run setup() again
+    // Enter deep sleep - device will restart after sleep_duration and run setup() again
     // The library will automatically reverse the sleep state when the display is next used
     esp_deep_sleep_start();
 }
@@ -198,6 +211,11 @@ void fetchAndDisplaySchedule() {
         // Add headers
         http.addHeader("User-Agent", "ESP32-DTEK-Display/1.0");
         http.addHeader("Connection", "close");
+        if (g_etag[0] != '\0' && g_payload[0] != '\0') {
+            http.addHeader("If-None-Match", g_etag);
+        }
+        const char* header_keys[] = {"ETag", "X-Sleep-Hint"};
+        http.collectHeaders(header_keys, 2);
         
         char attempt_msg[30];
         sprintf(attempt_msg, "[API] Attempt (%d/%d)...", http_attempts, MAX_HTTP_ATTEMPTS);
@@ -212,8 +230,26 @@ void fetchAndDisplaySchedule() {
         strcat(message, http_code_str);
         logToDisplay(message);
         
+        if (http_code == HTTP_CODE_OK || http_code == HTTP_CODE_NOT_MODIFIED) {
+            g_sleepHint = http.header("X-Sleep-Hint").toInt();
+        }
+        
         if (http_code == HTTP_CODE_OK) {
             payload = http.getString();
+            
+            // Remember response for the next conditional request
+            String etag = http.header("ETag");
+            if (etag.length() > 0 && etag.length() < sizeof(g_etag) && payload.length() < sizeof(g_payload)) {
+                strcpy(g_etag, etag.c_str());
+                strcpy(g_payload, payload.c_str());
+            } else {
+                g_etag[0] = '\0';
+            }
+            http.end();
+            http_success = true;
+        } else if (http_code == HTTP_CODE_NOT_MODIFIED) {
+            logToDisplay("[API] Not modified.");
+            payload = String(g_payload);
             http.end();
             http_success = true;
         } else {
@@ -537,6 +573,16 @@ uint64_t calculateSleepUntilNextHour() {
     return (uint64_t)sleep_seconds * 1000000ULL;
 }
 
+// Sleep duration from the server's X-Sleep-Hint (plus 30 seconds, capped at MAX_SLEEP_HINT),
+// or until the next hour boundary without one. Returns duration in microseconds
+uint64_t calculateSleepDuration() {
+    if (g_sleepHint <= 0) {
+        return calculateSleepUntilNextHour();
+    }
+    long sleep_seconds = min(g_sleepHint + 30, (long)MAX_SLEEP_HINT);
+    return (uint64_t)sleep_seconds * 1000000ULL;
+}
+
 // Read battery voltage from ADC
 float readBatteryVoltage() {
     // Battery sense via switched divider: drive ADC Ctrl LOW (turn on P-MOS), read ADC_IN, then turn it off
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Append-only, compressed archive of schedule snapshots for /schedule/history.
+
+Snapshots go into monthly segments (YYYY-MM.log) as zlib-compressed JSON
+records. Most records are deltas against the previous snapshot; a full
+keyframe starts every segment and every `keyframe_every` records, so a reader
+never decodes far back and old segments can be dropped or rewritten alone.
+
+Every segment has a fixed-width time index (YYYY-MM.idx) that readers
+memory-map and bisect, so a range query touches only the records it returns
+(plus at most one keyframe run before them) and never loads a whole segment.
+
+    log record:  [payload length u32][time i64][kind u8][zlib(json)]
+    index entry: [time i64][record offset u64][keyframe offset u64]
+
+Only one process may append (the refresher leader); any number may read.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+RECORD_HEADER = struct.Struct('<IqB')
+INDEX_ENTRY = struct.Struct('<qQQ')
+KEYFRAME = 0
+DELTA = 1
+DAILY_SUFFIX = '.daily'  # Segments compacted to one snapshot per day
+
+
+def make_delta(old, new):
+    """
+    Recursive delta between two JSON objects: {'s': {key: new value},
+    'd': [deleted keys], 'c': {key: delta of a nested object}}.
+    """
+    delta = {}
+    for key, value in new.items():
+        if key not in old:
+            delta.setdefault('s', {})[key] = value
+        elif old[key] == value:
+            continue
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            delta.setdefault('c', {})[key] = make_delta(old[key], value)
+        else:
+            delta.setdefault('s', {})[key] = value
+    deleted = [key for key in old if key not in new]
+    if deleted:
+        delta['d'] = deleted
+    return delta
+
+
+def apply_delta(old, delta):
+    """Inverse of make_delta(). Unchanged nested objects are shared with old."""
+    new = dict(old)
+    for key in delta.get('d', ()):
+        new.pop(key, None)
+    new.update(delta.get('s', {}))
+    for key, child in delta.get('c', {}).items():
+        new[key] = apply_delta(old[key], child)
+    return new
+
+
+def segment_name(timestamp):
+    """Monthly segment (local time) a snapshot taken at timestamp belongs to."""
+    return time.strftime('%Y-%m', time.localtime(timestamp))
+
+
+class TimeIndex:
+    """Read-only view of a memory-mapped segment index; indexes as a list of times."""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.count = len(buffer) // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return self.entry(i)[0]
+
+    def entry(self, i):
+        """(time, record offset, keyframe offset) of entry i."""
+        return INDEX_ENTRY.unpack_from(self.buffer, i * INDEX_ENTRY.size)
+
+
+def read_record(log_file, offset):
+    """Decode the record at offset. Returns (time, kind, payload)."""
+    log_file.seek(offset)
+    length, timestamp, kind = RECORD_HEADER.unpack(log_file.read(RECORD_HEADER.size))
+    return timestamp, kind, json.loads(zlib.decompress(log_file.read(length)))
+
+
+def iter_segment(log_path, idx_path, start, end):
+    """
+    Yield (time, document) for records of one segment with start <= time <= end.
+    Finds the first record by bisecting the mapped index and decodes from the
+    keyframe it depends on.
+    """
+    with open(idx_path, 'rb') as idx_file, open(log_path, 'rb') as log_file:
+        size = os.fstat(idx_file.fileno()).st_size
+        if size < INDEX_ENTRY.size:
+            return
+        with mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            index = TimeIndex(buffer)
+            first = bisect.bisect_left(index, start)
+            if first == len(index) or index[first] > end:
+                return
+
+            keyframe_offset = index.entry(first)[2]
+            i = first
+            while index.entry(i)[1] != keyframe_offset:
+                i -= 1
+
+            document = None
+            while i < len(index):
+                timestamp, offset, _ = index.entry(i)
+                if timestamp > end:
+                    return
+                _, kind, payload = read_record(log_file, offset)
+                document = payload if kind == KEYFRAME else apply_delta(document, payload)
+                if i >= first:
+                    yield timestamp, document
+                i += 1
+
+
+class SegmentWriter:
+    """Appends records to one segment, choosing keyframe or delta per record."""
+
+    def __init__(self, log_path, idx_path, keyframe_every, document=None, keyframe_offset=0, since_keyframe=0):
+        self.log_path = log_path
+        self.idx_path = idx_path
+        self.keyframe_every = keyframe_every
+        self.document = document  # Last document written to this segment
+        self.keyframe_offset = keyframe_offset
+        self.since_keyframe = since_keyframe
+
+    def write(self, timestamp, document):
+        if self.document is None or self.since_keyframe + 1 >= self.keyframe_every:
+            kind, payload = KEYFRAME, document
+        else:
+            kind, payload = DELTA, make_delta(self.document, document)
+        blob = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+        with open(self.log_path, 'ab') as log_file:
+            offset = log_file.tell()
+            log_file.write(RECORD_HEADER.pack(len(blob), int(timestamp), kind) + blob)
+        if kind == KEYFRAME:
+            self.keyframe_offset = offset
+            self.since_keyframe = 0
+        else:
+            self.since_keyframe += 1
+        # Index last: a record is only visible to readers once fully written
+        with open(self.idx_path, 'ab') as idx_file:
+            idx_file.write(INDEX_ENTRY.pack(int(timestamp), offset, self.keyframe_offset))
+        self.document = document
+        return RECORD_HEADER.size + len(blob)
+
+
+def repair_segment(log_path, idx_path):
+    """Cut a torn index entry or unindexed log tail left by a crash mid-append."""
+    size = os.path.getsize(idx_path)
+    if size % INDEX_ENTRY.size:
+        os.truncate(idx_path, size - size % INDEX_ENTRY.size)
+
+    with open(idx_path, 'rb') as idx_file:
+        entries = [INDEX_ENTRY.unpack(chunk) for chunk in iter(lambda: idx_file.read(INDEX_ENTRY.size), b'')]
+    log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+    end = 0
+    with open(log_path, 'ab+') as log_file:
+        valid = 0
+        for timestamp, offset, _ in entries:
+            if offset + RECORD_HEADER.size > log_size:
+                break
+            log_file.seek(offset)
+            length = RECORD_HEADER.unpack(log_file.read(RECORD_HEADER.size))[0]
+            if offset + RECORD_HEADER.size + length > log_size:
+                break
+            end = offset + RECORD_HEADER.size + length
+            valid += 1
+    if valid < len(entries):
+        os.truncate(idx_path, valid * INDEX_ENTRY.size)
+    if end < log_size:
+        os.truncate(log_path, end)
+    return entries[:valid]
+
+
+class SnapshotArchive:
+    """
+    The archive directory. append() records a snapshot if it differs from the
+    previous one and then applies the retention policy:
+    - segments older than compact_after_days are compacted to the last
+      snapshot of each day;
+    - segments older than retention_days are deleted;
+    - the oldest segments are deleted while the archive is over max_bytes.
+    """
+
+    def __init__(self, directory, keyframe_every=48, retention_days=365, max_bytes=64 * 1024 * 1024,
+                 compact_after_days=31):
+        self.directory = directory
+        self.keyframe_every = keyframe_every
+        self.retention_days = retention_days
+        self.max_bytes = max_bytes
+        self.compact_after_days = compact_after_days
+        self.lock = threading.Lock()
+        self.writer = None  # SegmentWriter for the newest segment, loaded on first append
+        self.segment = None
+        self.last_maintenance = 0
+        self.maintenance_interval = 3600
+
+    def paths(self, name):
+        base = os.path.join(self.directory, name)
+        return f"{base}.log", f"{base}.idx"
+
+    def segments(self):
+        """[(name, log path, idx path)] oldest first."""
+        try:
+            names = [entry[:-4] for entry in os.listdir(self.directory) if entry.endswith('.idx')]
+        except FileNotFoundError:
+            return []
+        return [(name, *self.paths(name)) for name in sorted(names, key=lambda name: name[:7])]
+
+    def size(self):
+        """Bytes on disk."""
+        total = 0
+        for _, log_path, idx_path in self.segments():
+            for path in (log_path, idx_path):
+                try:
+                    total += os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def iter_snapshots(self, start, end):
+        """Yield (time, document) for archived snapshots with start <= time <= end, oldest first."""
+        for _, log_path, idx_path in self.segments():
+            try:
+                yield from iter_segment(log_path, idx_path, start, end)
+            except FileNotFoundError:
+                continue  # Deleted or compacted while we were listing
+
+    def _open_writer(self, name):
+        """Writer for segment name, resuming from its last keyframe run if it exists."""
+        log_path, idx_path = self.paths(name)
+        if not os.path.exists(idx_path):
+            return SegmentWriter(log_path, idx_path, self.keyframe_every)
+
+        entries = repair_segment(log_path, idx_path)
+        if not entries:
+            return SegmentWriter(log_path, idx_path, self.keyframe_every)
+        keyframe_offset = entries[-1][2]
+        run = [entry for entry in entries if entry[2] == keyframe_offset]
+        document = None
+        with open(log_path, 'rb') as log_file:
+            for _, offset, _ in run:
+                _, kind, payload = read_record(log_file, offset)
+                document = payload if kind == KEYFRAME else apply_delta(document, payload)
+        return SegmentWriter(log_path, idx_path, self.keyframe_every, document, keyframe_offset, len(run) - 1)
+
+    def append(self, timestamp, document):
+        """Archive a snapshot unless it equals the previous one. Returns True if written."""
+        with self.lock:
+            if self.writer is None:
+                os.makedirs(self.directory, exist_ok=True)
+                segments = self.segments()
+                if segments:
+                    self.segment = segments[-1][0]
+                    self.writer = self._open_writer(self.segment)
+
+            previous = self.writer.document if self.writer else None
+            if previous == document:
+                return False
+
+            name = segment_name(timestamp)
+            if name != self.segment:
+                self.segment = name
+                self.writer = self._open_writer(name)
+            self.writer.write(timestamp, document)
+
+            if timestamp - self.last_maintenance >= self.maintenance_interval:
+                self.last_maintenance = timestamp
+                self.maintain(timestamp)
+            return True
+
+    def compact(self, name, log_path, idx_path):
+        """Rewrite a segment keeping only the last snapshot of each day."""
+        daily = {}
+        for timestamp, document in iter_segment(log_path, idx_path, 0, 2 ** 62):
+            daily[time.strftime('%Y-%m-%d', time.localtime(timestamp))] = (timestamp, document)
+
+        new_log, new_idx = self.paths(name[:7] + DAILY_SUFFIX)
+        writer = SegmentWriter(new_log + '.tmp', new_idx + '.tmp', self.keyframe_every)
+        for day in sorted(daily):
+            writer.write(*daily[day])
+        if writer.document is None:
+            # Index every segment has, even if empty
+            open(writer.idx_path, 'ab').close()
+            open(writer.log_path, 'ab').close()
+
+        # Hide the old segment before the new one appears (never list both)
+        os.replace(writer.log_path, new_log)
+        os.remove(idx_path)
+        os.replace(writer.idx_path, new_idx)
+        os.remove(log_path)
+        print(f"Archive: compacted {name} to {len(daily)} daily snapshot(s)")
+
+    def maintain(self, now):
+        """Apply compaction, retention and the size cap (never to the segment being written)."""
+        compact_before = segment_name(now - self.compact_after_days * 86400)
+        expire_before = segment_name(now - self.retention_days * 86400)
+
+        for name, log_path, idx_path in self.segments():
+            month = name[:7]
+            if month == self.segment:
+                continue
+            try:
+                if month < expire_before:
+                    os.remove(idx_path)
+                    os.remove(log_path)
+                    print(f"Archive: dropped {name} (older than {self.retention_days} days)")
+                elif month < compact_before and not name.endswith(DAILY_SUFFIX):
+                    self.compact(name, log_path, idx_path)
+            except OSError as e:
+                print(f"Warning: Archive maintenance failed for {name}: {e}")
+
+        segments = [segment for segment in self.segments() if segment[0][:7] != self.segment]
+        while segments and self.size() > self.max_bytes:
+            name, log_path, idx_path = segments.pop(0)
+            try:
+                os.remove(idx_path)
+                os.remove(log_path)
+            except OSError as e:
+                print(f"Warning: Archive maintenance failed for {name}: {e}")
+                break
+            print(f"Archive: dropped {name} (archive over {self.max_bytes // (1024 * 1024)} MB)")
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+ASGI serving mode for the DTEK schedule API.
+
+Cached reads (/, /health, /schedule, /schedule/simple, /schedule/packed,
+/schedule/forecast, /schedule/batch, /schedule/all, /schedule/stats,
+/schedule/next) and long-polls (/schedule/wait) are served directly on the
+event loop from the responses precompiled by server.py, so thousands of idle
+connections cost one coroutine each. Any other route (including /metrics) falls
+through to the Flask app in a thread pool. Both paths feed server.py's request metrics.
+Scraping stays in server.py's background refresher thread; the only blocking
+call on the request path (waiting for the very first snapshot) runs in an
+executor.
+
+Run with: uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+"""
+
+import asyncio
+import time
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import parse_accept_header, parse_date, parse_etags
+
+import server
+
+flask_app = WSGIMiddleware(server.app)
+
+# Wakes asyncio long-poll waiters when server.py compiles a new snapshot
+waiters = {
+    'loop': None,
+    'event': None
+}
+
+
+class Request:
+    """The bits of an ASGI HTTP scope the handlers need."""
+
+    def __init__(self, scope):
+        query = parse_qs(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        self.args = {key: values[0] for key, values in query.items()}
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                        for key, value in scope['headers']}
+        self.cache = None  # The requested region's cache, for routes that take region=
+
+    @property
+    def if_none_match(self):
+        return parse_etags(self.headers.get('if-none-match'))
+
+    @property
+    def if_modified_since(self):
+        return parse_date(self.headers.get('if-modified-since'))
+
+    @property
+    def accept_encodings(self):
+        return parse_accept_header(self.headers.get('accept-encoding'))
+
+
+async def send_response(send, status, headers, body):
+    raw_headers = [(key.encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
+    raw_headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': raw_headers
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, result, status=200, headers=None):
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    await send_response(send, status, headers, server.serialize(result))
+
+
+async def get_compiled(cache):
+    """
+    Compiled responses. Without data yet the whole lookup, including the wait
+    for the first snapshot, runs in an executor, never on the loop.
+    """
+    if cache['data'] is None:
+        return await asyncio.get_running_loop().run_in_executor(None, server.get_compiled, cache)
+    return server.get_compiled(cache)
+
+
+async def not_available(cache, send):
+    await send_json(send, {'error': 'Data not available yet'}, 503,
+                    {'Retry-After': str(cache['retry'])})
+
+
+def is_authorized(request):
+    return request.args.get('password', '') == server.API_PASSWORD
+
+
+async def index(request, send):
+    await send_json(send, server.service_info())
+
+
+async def health(request, send):
+    await send_json(send, server.health_status())
+
+
+async def schedule_endpoint(endpoint, mimetype, request, send, default_days='2', sleep_hint=False):
+    queue = request.args.get('queue', 'GPV3.1')
+    days = server.number_param(request.args, 'days', default_days)
+
+    compiled = await get_compiled(request.cache)
+    if compiled is None:
+        await not_available(request.cache, send)
+        return
+
+    entry = server.lookup_response(compiled, endpoint, queue, days)
+    status, headers, body = server.render_entry(request.cache, compiled, entry, mimetype,
+                                                request.if_none_match, request.if_modified_since,
+                                                request.accept_encodings)
+    if sleep_hint:
+        headers['X-Sleep-Hint'] = str(server.next_wake(compiled, queue, time.time())[3])
+    await send_response(send, status, headers, body)
+
+
+async def schedule(request, send):
+    await schedule_endpoint('full', 'application/json', request, send)
+
+
+async def schedule_simple(request, send):
+    await schedule_endpoint('simple', 'application/json', request, send, sleep_hint=True)
+
+
+async def schedule_forecast(request, send):
+    await schedule_endpoint('forecast', 'application/json', request, send, default_days='7')
+
+
+async def schedule_packed(request, send):
+    if request.args.get('queues'):
+        # Multi-queue payloads are rare; let Flask stitch them
+        return False
+    await schedule_endpoint('packed', 'application/octet-stream', request, send)
+
+
+async def schedule_batch(request, send):
+    compiled = await get_compiled(request.cache)
+    if compiled is None:
+        await not_available(request.cache, send)
+        return
+
+    entry = server.batch_response(compiled, request.args)
+    status, headers, body = server.render_entry(request.cache, compiled, entry, 'application/json',
+                                                request.if_none_match, request.if_modified_since,
+                                                request.accept_encodings)
+    await send_response(send, status, headers, body)
+
+
+async def schedule_stats(request, send):
+    compiled = await get_compiled(request.cache)
+    if compiled is None:
+        await not_available(request.cache, send)
+        return
+
+    entry = server.stats_response(compiled, request.args)
+    status, headers, body = server.render_entry(request.cache, compiled, entry, 'application/json',
+                                                request.if_none_match, request.if_modified_since,
+                                                request.accept_encodings)
+    await send_response(send, status, headers, body)
+
+
+async def schedule_all(request, send):
+    """NDJSON of every queue, sent one precompiled line per body message."""
+    compiled = await get_compiled(request.cache)
+    if compiled is None:
+        await not_available(request.cache, send)
+        return
+
+    endpoint, days = server.batch_params(request.args)
+    entries, _ = server.batch_entries(compiled, endpoint, compiled['queues'], days)
+    status, headers, _ = server.render_entry(request.cache, compiled, (200, b'', server.batch_etag(entries)),
+                                             'application/x-ndjson', request.if_none_match,
+                                             request.if_modified_since)
+    if status == 304:
+        await send_response(send, status, headers, b'')
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(key.encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
+    })
+    for _, entry in entries:
+        await send({'type': 'http.response.body', 'body': entry[1], 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def schedule_next(request, send):
+    compiled = await get_compiled(request.cache)
+    if compiled is None:
+        await not_available(request.cache, send)
+        return
+
+    result = server.next_response(compiled, request.args.get('queue', 'GPV3.1'))
+    headers = dict(server.freshness_headers(request.cache), **{'Cache-Control': 'no-cache'})
+    await send_json(send, result, headers=headers)
+
+
+async def schedule_wait(request, send):
+    """Same contract as /schedule/wait in server.py, one coroutine per waiter."""
+    queue = request.args.get('queue', 'GPV3.1')
+    since = request.args.get('since', '')
+    timeout = min(max(server.number_param(request.args, 'timeout', '60', float), 0), server.WAIT_MAX_TIMEOUT)
+
+    server.start_refresher()
+    register_waiters()
+    deadline = time.time() + timeout
+    while True:
+        event = waiters['event']
+        update = server.queue_update(request.cache, queue)
+        if update is not None and update != since:
+            break
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(event.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+
+    await send_json(send, {
+        'queue': queue,
+        'update': update,
+        'changed': update is not None and update != since
+    }, headers=server.freshness_headers(request.cache))
+
+
+# path: (handler, requires password and takes region=)
+ROUTES = {
+    '/': (index, False),
+    '/health': (health, False),
+    '/schedule': (schedule, True),
+    '/schedule/simple': (schedule_simple, True),
+    '/schedule/packed': (schedule_packed, True),
+    '/schedule/forecast': (schedule_forecast, True),
+    '/schedule/batch': (schedule_batch, True),
+    '/schedule/all': (schedule_all, True),
+    '/schedule/stats': (schedule_stats, True),
+    '/schedule/next': (schedule_next, True),
+    '/schedule/wait': (schedule_wait, True)
+}
+
+
+def register_waiters():
+    """Hook this event loop up to server.py's snapshot notifications (once)."""
+    if waiters['loop'] is not None:
+        return
+    waiters['loop'] = asyncio.get_running_loop()
+    waiters['event'] = asyncio.Event()
+    server.snapshot_listeners.append(_on_snapshot)
+
+
+def _fire_waiters():
+    event, waiters['event'] = waiters['event'], asyncio.Event()
+    event.set()
+
+
+def _on_snapshot():
+    """Called from server.py's refresher thread after each compile."""
+    loop = waiters['loop']
+    if loop is not None and not loop.is_closed():
+        loop.call_soon_threadsafe(_fire_waiters)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            register_waiters()
+            server.start_refresher()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _on_snapshot in server.snapshot_listeners:
+                server.snapshot_listeners.remove(_on_snapshot)
+            waiters['loop'] = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    route = ROUTES.get(scope['path']) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+    if route is None:
+        await flask_app(scope, receive, send)
+        return
+
+    started = time.perf_counter()
+    sent = []
+
+    async def send_counted(message):
+        if message['type'] == 'http.response.body':
+            sent.append(len(message.get('body', b'')))
+        await send(message)
+
+    if await serve(route, scope, send_counted) is False:
+        await flask_app(scope, receive, send)  # Flask records its own metrics
+        return
+    server.observe_request(scope['path'], time.perf_counter() - started, sum(sent))
+
+
+async def serve(route, scope, send):
+    """Run a route's handler; returns False if it left the request to Flask."""
+    handler, requires_password = route
+    request = Request(scope)
+    if requires_password and not is_authorized(request):
+        await send_json(send, {
+            'error': 'Unauthorized',
+            'message': 'Invalid or missing password'
+        }, 401)
+        return
+    if requires_password:
+        region = request.args.get('region', server.DEFAULT_REGION)
+        request.cache = server.caches.get(region)
+        if request.cache is None:
+            await send_json(send, server.unknown_region(region), 404)
+            return
+
+    try:
+        return await handler(request, send)
+    except server.BadParameter as e:
+        await send_json(send, server.bad_request(e), 400)
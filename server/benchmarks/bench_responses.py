@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: precompiled response table vs building each response per request.
+
+Run from the server directory:
+    python benchmarks/bench_responses.py [--requests 5000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import server  # noqa: E402
+from fake_dtek import make_schedule_data  # noqa: E402
+from flask import request  # noqa: E402
+
+
+@server.app.route('/bench/uncompiled/<endpoint>')
+@server.require_password
+@server.with_region
+def uncompiled(endpoint, cache):
+    """
+    /schedule or /schedule/simple with the response built per request instead
+    of looked up: same decorators, cache read and headers, so only that differs.
+    """
+    queue = request.args.get('queue', 'GPV3.1')
+    days = server.number_param(request.args, 'days', '2')
+    data = server.get_cached_data(cache)
+    if not data:
+        return server.not_available(cache)
+    entry = server.compile_response(endpoint, data['fact'], queue, days)
+    response = server.entry_response(cache, cache['responses'], entry)
+    if endpoint == 'simple':
+        response.headers['X-Sleep-Hint'] = str(server.next_wake(cache['responses'], queue, time.time())[3])
+    return response
+
+
+def run(client, url, count, repeat=3):
+    """Best requests/sec over a few rounds (least disturbed by noise)."""
+    best = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+        best = max(best, count / (time.perf_counter() - start))
+    return best
+
+
+def run_calls(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+    
+    server.start_refresher = lambda: None
+    cache = server.caches[server.DEFAULT_REGION]
+    cache['data'] = make_schedule_data()
+    cache['timestamp'] = time.time()
+    cache['generation'] = 1
+    server.compile_responses(cache)
+    
+    client = server.app.test_client()
+    password = server.API_PASSWORD
+    cases = [
+        ('/schedule', f'/schedule?password={password}&queue=GPV3.1&days=2',
+         f'/bench/uncompiled/full?password={password}&queue=GPV3.1&days=2'),
+        ('/schedule/simple', f'/schedule/simple?password={password}&queue=GPV3.1&days=2',
+         f'/bench/uncompiled/simple?password={password}&queue=GPV3.1&days=2'),
+    ]
+    
+    print(f"{'endpoint':<18} {'uncompiled req/s':>17} {'compiled req/s':>15} {'speedup':>8}")
+    for name, compiled_url, uncompiled_url in cases:
+        run(client, compiled_url, 200)  # Warm up
+        before = run(client, uncompiled_url, args.requests)
+        after = run(client, compiled_url, args.requests)
+        print(f"{name:<18} {before:>17.0f} {after:>15.0f} {after / before:>7.2f}x")
+    
+    # Response body work alone, without the WSGI/test client overhead
+    fact_json = cache['data']['fact']
+    table = cache['responses']['table']
+    print(f"\n{'body only':<18} {'build calls/s':>17} {'lookups/s':>15} {'speedup':>8}")
+    for endpoint in ('full', 'simple'):
+        before = run_calls(lambda: server.compile_response(endpoint, fact_json, 'GPV3.1', 2), args.requests)
+        after = run_calls(lambda: table[(endpoint, 'GPV3.1', 2)], args.requests * 10)
+        print(f"{endpoint:<18} {before:>17.0f} {after:>15.0f} {after / before:>7.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite against a local DTEK stand-in (benchmarks/fake_dtek.py).
+
+Measures, without touching the real DTEK site:
+- fetch: cold and warm fetch latency by phase, for the plain HTTP fast path
+  and (when Chromium is installed) the browser path with the full and the lean
+  scraping profile, with requests per page load and browser memory
+- serve: p50/p99 latency and throughput of /schedule and /schedule/simple on
+  a real server process (gunicorn or uvicorn) at each concurrency level
+- memory: resident memory of each server worker after the load
+- startup: time to import the server app in a fresh interpreter (a worker's
+  cold start) and the resident memory that leaves
+
+Run from the server directory:
+    python benchmarks/bench_suite.py [--server gunicorn] [--workers 2] \\
+        [--concurrency 1,10,50] [--duration 5] [--json results.json]
+
+--json writes every number machine-readable ("-" for stdout), to compare runs
+before and after a change to the scraper or the serving path.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_dtek  # noqa: E402
+import loadtest  # noqa: E402
+
+ENDPOINTS = ('/schedule', '/schedule/simple')
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def summarize(runs):
+    """Per-phase median (ms) over several runs of {phase: seconds}."""
+    return {phase: ms(statistics.median(run[phase] for run in runs)) for phase in runs[0]}
+
+
+def seed_cookies(snapshot_dir, url):
+    """Cookies for the stand-in's host, so the fast path works without a browser session."""
+    import scraper
+    os.makedirs(snapshot_dir, exist_ok=True)
+    with open(os.path.join(snapshot_dir, f'cookies.{scraper.site_host(url)}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'cookies': {'incap_ses_bench': '1'}, 'user_agent': 'Mozilla/5.0 (bench)'}, f)
+
+
+def fast_path_phases(scraper, url):
+    """One fast path fetch split into request (connect + headers), download and parse."""
+    host = scraper.site_host(url)
+    site = scraper.fast_path.get(host) or {}
+    headers = {'Cookie': '; '.join(f'{name}={value}' for name, value in (site.get('cookies') or {}).items())}
+
+    start = time.perf_counter()
+    response = scraper.http_pool.request('GET', url, headers=headers, preload_content=False)
+    requested = time.perf_counter()
+    chunks = list(scraper.decode_chunks(response.stream(16384, decode_content=True)))
+    response.release_conn()
+    downloaded = time.perf_counter()
+    preset_json, fact_json = scraper.parse_discon_schedule(chunks)
+    parsed = time.perf_counter()
+    if not scraper.is_valid_schedule(preset_json, fact_json):
+        raise RuntimeError('Stand-in page did not parse')
+
+    # The real function streams and stops reading once both objects are parsed
+    total_start = time.perf_counter()
+    if not scraper.fetch_schedule_data_fast(url):
+        raise RuntimeError('Fast path failed against the stand-in page')
+    return {
+        'request': requested - start,
+        'download': downloaded - requested,
+        'parse': parsed - downloaded,
+        'total': time.perf_counter() - total_start
+    }
+
+
+def bench_fast_path(scraper, url, runs):
+    """Cold (new connection pool) and warm (kept-alive connection) fast path fetches."""
+    scraper.load_cookies(scraper.site_host(url))
+    cold = []
+    for _ in range(runs):
+        scraper.http_pool.clear()
+        cold.append(fast_path_phases(scraper, url))
+    warm = [fast_path_phases(scraper, url) for _ in range(runs)]
+    return {'cold': summarize(cold), 'warm': summarize(warm)}
+
+
+def browser_phases(scraper, driver, url, warm):
+    """One browser fetch split into navigate, readiness wait (with the data transfer) and parsing."""
+    start = time.perf_counter()
+    if warm:
+        driver.refresh()
+    else:
+        driver.get(url)
+    navigated = time.perf_counter()
+    text = scraper.wait_for_page_schedule(driver, 30)
+    ready = time.perf_counter()
+    preset_json, fact_json = scraper.parse_schedule_json(text)
+    extracted = time.perf_counter()
+    if not preset_json or not fact_json:
+        raise RuntimeError('Browser did not find DisconSchedule on the stand-in page')
+    return {
+        'navigate': navigated - start,
+        'ready': ready - navigated,
+        'extract': extracted - ready,
+        'total': extracted - start
+    }
+
+
+def bench_browser(scraper, site, runs, profile):
+    """
+    Cold (browser launch + first load) and warm (reload in the same session)
+    fetches with one browser profile, plus the requests a page load makes to
+    the stand-in and the browser's peak resident memory.
+    """
+    cold = []
+    warm = []
+    requests = []
+    rss = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            driver = scraper.setup_driver(profile)
+        except Exception as e:
+            return {'skipped': f'Could not start the browser: {e}'}
+        launched = time.perf_counter() - start
+        try:
+            before = sum(site.stats.values())
+            phases = browser_phases(scraper, driver, site.url, warm=False)
+            time.sleep(0.5)  # Let async assets the eager load did not wait for arrive
+            requests.append(sum(site.stats.values()) - before)
+            phases['launch'] = launched
+            phases['total'] += launched
+            cold.append(phases)
+            warm.append(browser_phases(scraper, driver, site.url, warm=True))
+            rss.append(scraper.driver_rss(driver))
+        finally:
+            driver.quit()
+    return {
+        'cold': summarize(cold),
+        'warm': summarize(warm),
+        'requests_per_load': statistics.median(requests),
+        'peak_rss_mb': round(max(rss) / (1024 * 1024), 1)
+    }
+
+
+def bench_startup(runs):
+    """Median import time of the server app in a new process, and the memory it leaves."""
+    code = ("import sys, time; start = time.perf_counter(); import server; "
+            "print(time.perf_counter() - start, 'undetected_chromedriver' in sys.modules or 'selenium' in sys.modules)")
+    times = []
+    rss = []
+    for _ in range(runs):
+        process = subprocess.Popen([sys.executable, '-c', code + '; sys.stdout.flush(); sys.stdin.read()'],
+                                   cwd=SERVER_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        try:
+            seconds, browser_loaded = process.stdout.readline().split()
+            times.append(float(seconds))
+            rss.append(rss_mb(process.pid))
+        finally:
+            process.communicate('')
+    return {
+        'import_ms': ms(statistics.median(times)),
+        'rss_mb': statistics.median(rss),
+        'browser_stack_loaded': browser_loaded == 'True'
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, workers, port):
+    if kind == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--workers', str(workers),
+                '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'gevent', '--worker-connections', '1000',
+            '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'server:app']
+
+
+def wait_until_serving(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def child_pids(pid):
+    """Direct children of a process (the server's workers). Linux only."""
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces; fields after it are fixed
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            children.append(int(name))
+    return children
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def bench_serving(site_url, snapshot_dir, kind, workers, concurrency, duration):
+    """Start a real server process against the stand-in and load test it."""
+    port = free_port()
+    env = dict(os.environ, REGIONS=f'dnem={site_url}', SNAPSHOT_DIR=snapshot_dir, ARCHIVE_DIR='',
+               API_PASSWORD='bench')
+    process = subprocess.Popen(server_command(kind, workers, port), cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        if not wait_until_serving(f'{base}/schedule/simple?password=bench&queue=GPV3.1'):
+            return {'error': f'{kind} did not start serving'}, {}
+
+        results = []
+        for endpoint in ENDPOINTS:
+            url = f'{base}{endpoint}?password=bench&queue=GPV3.1&days=2'
+            asyncio.run(loadtest.run(url, 1, 0.5))  # Warm up every worker's first request
+            for connections in concurrency:
+                result = asyncio.run(loadtest.run(url, connections, duration))
+                result['endpoint'] = endpoint
+                results.append(result)
+
+        workers_rss = {str(pid): rss_mb(pid) for pid in child_pids(process.pid)}
+        memory = {
+            'master_rss_mb': rss_mb(process.pid),
+            'worker_rss_mb': workers_rss,
+            'max_worker_rss_mb': max([rss for rss in workers_rss.values() if rss] + [0])
+        }
+        return results, memory
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def print_report(report):
+    print(f"Stand-in page: {report['meta']['page_kb']} KB, {report['meta']['queues']} queues, "
+          f"{report['meta']['days']} days")
+    startup = report['startup']
+    print(f"Worker cold start: import {startup['import_ms']} ms, RSS {startup['rss_mb']} MB"
+          + (" (browser stack loaded)" if startup['browser_stack_loaded'] else ""))
+    for path, fetch in report['fetch'].items():
+        if 'skipped' in fetch:
+            print(f"\nFetch ({path}): skipped - {fetch['skipped']}")
+            continue
+        print(f"\nFetch ({path}), median ms:")
+        for mode in ('cold', 'warm'):
+            print(f"  {mode:<5} " + '  '.join(f"{phase} {value}" for phase, value in fetch[mode].items()))
+        if 'peak_rss_mb' in fetch:
+            print(f"  requests per load {fetch['requests_per_load']}, browser RSS {fetch['peak_rss_mb']} MB")
+
+    serve = report['serve']
+    if isinstance(serve, dict):
+        print(f"\nServing: {serve['error']}")
+        return
+    print(f"\nServing ({report['meta']['server']}, {report['meta']['workers']} workers):")
+    print(f"  {'endpoint':<18} {'conns':>5} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    for result in serve:
+        print(f"  {result['endpoint']:<18} {result['connections']:>5} {result['rps']:>9} "
+              f"{result['p50_ms']:>8} {result['p99_ms']:>8} {result['errors']:>6}")
+    memory = report['memory']
+    if memory:
+        print(f"\nMemory: master {memory['master_rss_mb']} MB, workers "
+              + ', '.join(f"{rss} MB" for rss in memory['worker_rss_mb'].values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark suite against a local DTEK stand-in')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', default='1,10,50', help='Comma-separated connection counts')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds per load test')
+    parser.add_argument('--runs', type=int, default=5, help='Fetches per fetch measurement')
+    parser.add_argument('--queues', type=int, default=12)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--asset-delay', type=float, default=0.05, help="Seconds the stand-in's assets take")
+    parser.add_argument('--skip-browser', action='store_true', help='Do not measure the browser path')
+    parser.add_argument('--json', metavar='PATH', help='Write results as JSON ("-" for stdout)')
+    args = parser.parse_args()
+
+    snapshot_dir = tempfile.mkdtemp(prefix='dtek-bench-')
+    os.environ['SNAPSHOT_DIR'] = snapshot_dir
+    os.environ['ARCHIVE_DIR'] = ''
+    site = fake_dtek.FakeDtek(queues=args.queues, days=args.days, asset_delay=args.asset_delay).start()
+    os.environ['REGIONS'] = f'dnem={site.url}'
+    # The stand-in's "third-party" assets come from another host name; block it like a real third party
+    os.environ['SCRAPE_BLOCKED_URLS'] = f'*://{site.third_party_host}:*'
+    try:
+        seed_cookies(snapshot_dir, site.url)
+        import scraper
+
+        report = {
+            'meta': {
+                'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'queues': args.queues,
+                'days': args.days,
+                'page_kb': len(site.page) // 1024,
+                'server': args.server,
+                'workers': args.workers,
+                'duration': args.duration
+            },
+            'startup': bench_startup(args.runs),
+            'fetch': {'fast_path': bench_fast_path(scraper, site.url, args.runs)}
+        }
+        for profile in ('full', 'lean'):
+            if args.skip_browser:
+                report['fetch'][f'browser_{profile}'] = {'skipped': '--skip-browser'}
+            else:
+                report['fetch'][f'browser_{profile}'] = bench_browser(scraper, site, args.runs, profile)
+
+        concurrency = [int(value) for value in args.concurrency.split(',') if value]
+        report['serve'], report['memory'] = bench_serving(site.url, snapshot_dir, args.server, args.workers,
+                                                          concurrency, args.duration)
+    finally:
+        site.stop()
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+        return
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a DTEK shutdowns page, for benchmarks and offline testing.
+
+Serves a page shaped like the real one: the DisconSchedule preset and fact
+objects inline, surrounded by the stylesheets, fonts, images, map and analytics
+scripts the real page pulls in (served from here too, each after --asset-delay;
+"third-party" ones from --third-party-host). Point the server at it with:
+
+    python benchmarks/fake_dtek.py --port 8000 --queues 12 --days 2
+    REGIONS=dnem=http://127.0.0.1:8000/ua/shutdowns python server.py
+
+GET /__stats returns request counts per path.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_PATH = '/ua/shutdowns'
+
+# (path, content type, size in bytes, third party)
+ASSETS = [
+    ('/static/css/app.css', 'text/css', 180000, False),
+    ('/static/css/vendor.css', 'text/css', 60000, False),
+    ('/static/fonts/roboto-regular.woff2', 'font/woff2', 65000, False),
+    ('/static/fonts/roboto-bold.woff2', 'font/woff2', 66000, False),
+    ('/static/img/logo.svg', 'image/svg+xml', 12000, False),
+    ('/static/img/banner.jpg', 'image/jpeg', 240000, False),
+    ('/static/img/map-tiles.png', 'image/png', 320000, False),
+    ('/static/js/vendor.js', 'application/javascript', 400000, False),
+    ('/static/js/app.js', 'application/javascript', 150000, False),
+    ('/gtag/js', 'application/javascript', 110000, True),
+    ('/maps/api/js', 'application/javascript', 220000, True),
+    ('/widget/chat.js', 'application/javascript', 90000, True),
+]
+
+
+def queue_names(count):
+    """GPV1.1, GPV1.2, ... GPV6.2 like DTEK, continuing past 6 groups if asked for more."""
+    return [f"GPV{group}.{sub}" for group in range(1, count // 2 + 2) for sub in (1, 2)][:count]
+
+
+def outage_day(rnd, statuses):
+    """24 hours ("1".."24") with a few multi-hour outage blocks, half-hour edges included."""
+    hours = ['yes'] * 24
+    for _ in range(rnd.randint(0, 3)):
+        start = rnd.randrange(24)
+        end = min(24, start + rnd.randint(2, 5))
+        for hour in range(start, end):
+            hours[hour] = statuses[0]
+        if start > 0 and hours[start - 1] == 'yes' and rnd.random() < 0.5:
+            hours[start - 1] = statuses[1]  # Off for the second half of the hour before
+        if end < 24 and rnd.random() < 0.5:
+            hours[end] = statuses[2]  # Off for the first half of the hour after
+    return {str(hour + 1): status for hour, status in enumerate(hours)}
+
+
+def make_schedule_data(queues=12, days=2, seed=1, update=None):
+    """Synthetic DisconSchedule {'preset', 'fact'} payload shaped like the DTEK one."""
+    rnd = random.Random(seed)
+    today = int(time.mktime(datetime.date.today().timetuple()))
+    names = queue_names(queues)
+    fact = {
+        'data': {
+            str(today + day * 86400): {name: outage_day(rnd, ('no', 'second', 'first')) for name in names}
+            for day in range(days)
+        },
+        'update': update or datetime.datetime.now().strftime('%d.%m.%Y %H:%M'),
+        'today': today
+    }
+    preset = {
+        'data': {
+            name: {str(weekday): outage_day(rnd, ('maybe', 'msecond', 'mfirst')) for weekday in range(1, 8)}
+            for name in names
+        },
+        'sch_names': {name: f"Черга {name[3:]}" for name in names},
+        'days': {str(weekday): name for weekday, name in enumerate(
+            ['Понеділок', 'Вівторок', 'Середа', 'Четвер', "П'ятниця", 'Субота', 'Неділя'], 1)},
+        'time_zone': {str(hour + 1): [f"{hour:02d}-{hour + 1:02d}", f"{hour:02d}:00", f"{hour + 1:02d}:00"]
+                      for hour in range(24)},
+        'time_type': {
+            'yes': 'Світло є',
+            'maybe': 'Можливо відключення',
+            'no': 'Світла немає',
+            'first': 'Світла не буде перші 30 хв.',
+            'second': 'Світла не буде другі 30 хв',
+            'mfirst': 'Світла можливо не буде перші 30 хв.',
+            'msecond': 'Світла можливо не буде другі 30 хв'
+        }
+    }
+    return {'preset': preset, 'fact': fact}
+
+
+def render_page(data, asset_base='', third_party_base=''):
+    """The shutdowns page HTML, with the schedule inline and the usual assets around it."""
+    head = []
+    body = []
+    for path, content_type, _, third_party in ASSETS:
+        url = (third_party_base if third_party else asset_base) + path
+        if content_type == 'text/css':
+            head.append(f'<link rel="stylesheet" href="{url}">')
+        elif content_type.startswith('font/'):
+            head.append(f'<link rel="preload" as="font" type="{content_type}" href="{url}" crossorigin>')
+        elif content_type.startswith('image/'):
+            body.append(f'<img src="{url}" alt="">')
+        else:
+            body.append(f'<script src="{url}" async></script>')
+
+    # Markup the schedule is embedded in, padded to about the real page size
+    filler = ''.join(
+        f'<div class="news-item"><a href="/ua/news/{i}">Новина {i}</a><p>{"Текст новини. " * 40}</p></div>'
+        for i in range(40)
+    )
+    schedule = (
+        '<script>\n'
+        'var DisconSchedule = window.DisconSchedule || {};\n'
+        f"DisconSchedule.preset = {json.dumps(data['preset'], ensure_ascii=False)}\n"
+        f"DisconSchedule.fact = {json.dumps(data['fact'], ensure_ascii=False)}\n"
+        '</script>'
+    )
+    return (
+        '<!DOCTYPE html><html lang="uk"><head><meta charset="utf-8"><title>Відключення</title>'
+        + ''.join(head) + '</head><body><header>' + ''.join(body[:2]) + '</header>'
+        + '<main><div id="discon-fact"></div>' + schedule + filler + '</main>'
+        + ''.join(body[2:]) + '</body></html>'
+    )
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Clients hanging up early (the fast path stops reading once it has the data) are normal."""
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeDtek:
+    """The stand-in site: page, assets and request counters, served from a thread."""
+
+    def __init__(self, host='127.0.0.1', port=0, queues=12, days=2, page_delay=0.0, asset_delay=0.05,
+                 third_party_host='localhost'):
+        self.data = make_schedule_data(queues, days)
+        self.page_delay = page_delay
+        self.asset_delay = asset_delay
+        self.third_party_host = third_party_host
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.httpd = QuietHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f'http://{host}:{self.port}{PAGE_PATH}'
+        self.page = render_page(self.data, '', f'http://{third_party_host}:{self.port}').encode('utf-8')
+        self.assets = {path: (content_type, b'/*' + b'x' * (size - 4) + b'*/')
+                       for path, content_type, size, _ in ASSETS}
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fake-dtek', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                with site.lock:
+                    site.stats[path] = site.stats.get(path, 0) + 1
+                if path == PAGE_PATH:
+                    time.sleep(site.page_delay)
+                    self._send(200, 'text/html; charset=utf-8', site.page)
+                elif path in site.assets:
+                    time.sleep(site.asset_delay)
+                    self._send(200, *site.assets[path])
+                elif path == '/__stats':
+                    with site.lock:
+                        body = json.dumps(site.stats).encode('utf-8')
+                    self._send(200, 'application/json', body)
+                else:
+                    self._send(404, 'text/plain', b'not found')
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for a DTEK shutdowns page')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--queues', type=int, default=12)
+    parser.add_argument('--days', type=int, default=2)
+    parser.add_argument('--page-delay', type=float, default=0.0, help='Seconds before the page is served')
+    parser.add_argument('--asset-delay', type=float, default=0.05, help='Seconds before each asset is served')
+    parser.add_argument('--third-party-host', default='localhost',
+                        help='Host name "third-party" assets are loaded from')
+    args = parser.parse_args()
+
+    site = FakeDtek(args.host, args.port, args.queues, args.days, args.page_delay, args.asset_delay,
+                    args.third_party_host)
+    print(f"Serving {site.url} ({len(site.page) // 1024} KB page, {len(ASSETS)} assets)")
+    try:
+        site.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
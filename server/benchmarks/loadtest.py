@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+HTTP load generator: keep-alive connections hammering one URL.
+
+Run against a running server:
+    python benchmarks/loadtest.py http://127.0.0.1:5000/schedule/simple?password=... \\
+        --connections 50 --duration 10
+
+Prints requests/sec and latency percentiles; --json prints them machine-readable.
+--idle N keeps N extra connections parked on a long-poll (/schedule/wait) URL
+during the test, to see how idle clients affect cached reads.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+async def fetch_loop(host, port, target, deadline, latencies, errors):
+    """One keep-alive connection issuing requests back to back until deadline."""
+    request = f"GET {target} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: loadtest\r\n\r\n".encode('latin-1')
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            start = time.perf_counter()
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+            status = int(head.split(b' ', 2)[1])
+            length = 0
+            close = False
+            for line in head.split(b'\r\n')[1:]:
+                name, _, value = line.partition(b':')
+                name = name.strip().lower()
+                if name == b'content-length':
+                    length = int(value)
+                elif name == b'connection' and value.strip().lower() == b'close':
+                    close = True
+            if length:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+            if close:
+                writer.close()
+                writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            errors.append(type(e).__name__)
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.01)
+    if writer is not None:
+        writer.close()
+
+
+async def hold_idle(host, port, target, deadline, held):
+    """Park one connection on a long-poll request until deadline."""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+        held.append(1)
+        await asyncio.wait_for(reader.read(1), max(0.1, deadline - time.perf_counter()))
+    except (OSError, asyncio.TimeoutError):
+        pass
+    else:
+        writer.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(url, connections, duration, idle=0, idle_url=None):
+    """Run the load test; returns a result dict."""
+    parts = urlsplit(url)
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    latencies = []
+    errors = []
+    held = []
+    
+    idle_tasks = []
+    if idle:
+        idle_parts = urlsplit(idle_url)
+        idle_target = idle_parts.path + (f'?{idle_parts.query}' if idle_parts.query else '')
+        idle_deadline = time.perf_counter() + duration + 2
+        idle_tasks = [
+            asyncio.ensure_future(hold_idle(idle_parts.hostname, idle_parts.port or 80, idle_target,
+                                            idle_deadline, held))
+            for _ in range(idle)
+        ]
+        await asyncio.sleep(1)  # Let them connect
+    
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        fetch_loop(parts.hostname, parts.port or 80, target, deadline, latencies, errors)
+        for _ in range(connections)
+    ])
+    elapsed = time.perf_counter() - start
+    for task in idle_tasks:
+        task.cancel()
+    await asyncio.gather(*idle_tasks, return_exceptions=True)
+    return {
+        'url': url,
+        'connections': connections,
+        'idle_connections': len(held),
+        'duration': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep-alive HTTP load generator')
+    parser.add_argument('url')
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--idle', type=int, default=0, help='Extra connections parked on --idle-url')
+    parser.add_argument('--idle-url', help='Long-poll URL for idle connections (default: /schedule/wait on the same server)')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON')
+    args = parser.parse_args()
+    
+    idle_url = args.idle_url
+    if args.idle and not idle_url:
+        parts = urlsplit(args.url)
+        query = dict(pair.split('=', 1) for pair in parts.query.split('&') if '=' in pair)
+        idle_url = (f"{parts.scheme}://{parts.netloc}/schedule/wait?password={query.get('password', '')}&queue=idle"
+                    f"&timeout=110")
+    
+    result = asyncio.run(run(args.url, args.connections, args.duration, args.idle, idle_url))
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"{result['requests']} requests in {result['duration']}s over {result['connections']} connections "
+              f"({result['idle_connections']} idle), {result['errors']} errors")
+        print(f"{result['rps']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Process-local counters and histograms, exported in the Prometheus text format.
+
+Recording is a dict update under a lock, so it is cheap enough for the request
+path. A background thread in each process publishes its values to
+<directory>/metrics.<pid>.json every `flush_interval` seconds when they changed
+(and the process does so itself whenever it answers a scrape); a scrape
+sums the files of every worker on the host, so whichever gunicorn worker gets
+/metrics reports the whole server. Files of dead workers are folded into
+metrics.retired.json, so counters never go backwards when a worker is replaced.
+"""
+
+import bisect
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+RETIRED_FILE = 'metrics.retired.json'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels) + '}'
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge_values(total, values):
+    """Add one process's values ({(name, labels): value}) into total."""
+    for key, value in values.items():
+        if key not in total:
+            total[key] = [list(value[0]), value[1]] if isinstance(value, list) else value
+        elif isinstance(value, list):
+            counts, total_sum = total[key]
+            total[key] = [[a + b for a, b in zip(counts, value[0])], total_sum + value[1]]
+        else:
+            total[key] += value
+    return total
+
+
+def dump_values(values):
+    return [[name, [list(label) for label in labels], value] for (name, labels), value in values.items()]
+
+
+def load_values(path):
+    """Values from a metrics file; {} if it is missing or torn."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        return {(name, tuple(tuple(label) for label in labels)): value for name, labels, value in items}
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def write_values(path, values):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dump_values(values), f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+class Metrics:
+    """
+    Registry of counters and histograms for this process. Declare metrics
+    with counter()/histogram() at import time, record with inc()/observe(),
+    and serve render() on /metrics.
+    """
+
+    def __init__(self, directory, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.definitions = {}  # name: (type, help, histogram buckets)
+        self._reset()
+        # Workers forked from a preloaded app must not inherit (and double count) the parent's values
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        self.values = {}  # (name, labels): count, or [bucket counts, sum] for histograms
+        self.dirty = False
+        self.flusher = None  # Started on first use, so it runs in the worker and not a pre-fork parent
+        self.flush_failed = False
+
+    def counter(self, name, help):
+        self.definitions[name] = ('counter', help, None)
+
+    def histogram(self, name, help, buckets):
+        self.definitions[name] = ('histogram', help, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+            self.dirty = True
+        if self.flusher is None:
+            self._start_flusher()
+
+    def observe(self, name, value, **labels):
+        buckets = self.definitions[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(buckets, value)] += 1
+            entry[1] += value
+            self.dirty = True
+        if self.flusher is None:
+            self._start_flusher()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the wall time of a with block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _start_flusher(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+            self.flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self.dirty:
+                self.flush()
+
+    def flush(self):
+        """Publish this process's values for other workers' scrapes."""
+        with self.lock:
+            self.dirty = False
+            values = {key: [list(value[0]), value[1]] if isinstance(value, list) else value
+                      for key, value in self.values.items()}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_values(os.path.join(self.directory, f"metrics.{os.getpid()}.json"), values)
+        except OSError as e:
+            # Best effort: this worker's values are still in its own scrapes
+            if not self.flush_failed:
+                print(f"Warning: Could not write metrics to {self.directory}: {e}")
+            self.flush_failed = True
+
+    def collect(self):
+        """
+        Values summed over every worker on this host, including ones that
+        exited. Runs under a lock file so no file is counted both as a dead
+        worker's and as part of the retired totals.
+        """
+        self.flush()
+        try:
+            with open(os.path.join(self.directory, 'metrics.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                return self._collect_files()
+        except OSError as e:
+            print(f"Warning: Could not read metrics from {self.directory}: {e}")
+            with self.lock:
+                return merge_values({}, self.values)
+
+    def _collect_files(self):
+        pid = os.getpid()
+        total = {}
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        retired = load_values(retired_path)
+        dead = []
+        for name in os.listdir(self.directory):
+            parts = name.split('.')
+            if len(parts) != 3 or parts[0] != 'metrics' or parts[2] != 'json' or not parts[1].isdigit():
+                continue
+            path = os.path.join(self.directory, name)
+            if int(parts[1]) == pid:
+                with self.lock:
+                    merge_values(total, self.values)
+            elif pid_alive(int(parts[1])):
+                merge_values(total, load_values(path))
+            else:
+                merge_values(retired, load_values(path))
+                dead.append(path)
+
+        if dead:
+            # Fold dead workers into the retired totals, so counters never go backwards
+            write_values(retired_path, retired)
+            for path in dead:
+                os.remove(path)
+        return merge_values(total, retired)
+
+    def render(self, gauges=()):
+        """
+        Prometheus text exposition of the collected values plus gauges given
+        as (name, help, [(labels dict, value)]) computed by the caller.
+        """
+        by_name = {}
+        for (name, labels), value in self.collect().items():
+            if name in self.definitions:
+                by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(self.definitions):
+            kind, help, buckets = self.definitions[name]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name.get(name, [])):
+                if kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                counts, total_sum = value
+                cumulative = 0
+                for bound, count in zip(buckets + (math.inf,), counts):
+                    cumulative += count
+                    bucket_labels = labels + (('le', format_value(float(bound))),)
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(total_sum)}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        for name, help, samples in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(sorted(labels.items()))} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,21 @@
+#!/bin/bash
+# Production server in ASGI mode (uvicorn)
+
+cd "$(dirname "$0")"
+source venv/bin/activate
+
+# Optional: Set custom password via environment variable
+# export API_PASSWORD="your_secure_password"
+
+# Run with Uvicorn
+# --workers 2: 2 worker processes; only one of them scrapes (shared snapshot)
+# --host 0.0.0.0 --port 5000: bind to all interfaces on port 5000
+# Cached reads and long-polls are served on the event loop, so idle
+# connections don't depend on the worker count. Scraping runs in a
+# background thread and never blocks requests.
+
+uvicorn asgi:app \
+  --workers 2 \
+  --host 0.0.0.0 \
+  --port 5000 \
+  --timeout-keep-alive 30
@@ -9,12 +9,18 @@ source venv/bin/activate
 
 # Run with Gunicorn
 # -w 2: 2 worker processes (adjust based on your CPU cores)
+#       only one of them scrapes; the others read the shared snapshot
+# -k gevent: async workers, so long-polls (/schedule/wait) don't block a worker each
+# --worker-connections 1000: max concurrent connections per worker
 # -b 0.0.0.0:5000: bind to all interfaces on port 5000
-# --timeout 120: 120 second timeout (needed for Selenium operations)
+# --timeout 120: worker heartbeat timeout (scraping runs in a background thread,
+#               requests never wait for Selenium)
 # --access-logfile -: log to stdout
 # --error-logfile -: log errors to stdout
 
 gunicorn -w 2 \
+  -k gevent \
+  --worker-connections 1000 \
   -b 0.0.0.0:5000 \
   --timeout 120 \
   --access-logfile - \
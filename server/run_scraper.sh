@@ -0,0 +1,8 @@
+#!/bin/bash
+# Scraper daemon: does all scraping outside the API workers
+# Start the API server with SCRAPER_DAEMON=1 and the same SNAPSHOT_DIR
+
+cd "$(dirname "$0")"
+source venv/bin/activate
+
+python scraper_daemon.py
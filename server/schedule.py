@@ -0,0 +1,598 @@
+#!/usr/bin/env python3
+"""
+DTEK schedule data: DisconSchedule parsing and the response formats built
+from it (full, simple, forecast and packed), plus the fact matrix behind the
+outage stats and the power transition index.
+
+Plain functions over the page's `preset` and `fact` objects with no web or
+browser dependencies, shared by the server and the command line tool.
+"""
+
+import codecs
+import datetime
+import json
+import time
+from array import array
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+try:
+    import numpy as np
+    USE_NUMPY = True
+except ImportError:
+    USE_NUMPY = False  # Fact matrices are flat array('B') buffers and stats run in Python
+
+
+def _dtek_timezone():
+    """Time zone of DTEK's `update` stamps; None (use local time) without zone data."""
+    for name in ('Europe/Kyiv', 'Europe/Kiev'):
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            continue
+    return None
+
+
+DTEK_TZ = _dtek_timezone()
+
+
+def parse_update_time(fact_json, default):
+    """Timestamp of DTEK's `update` stamp ("dd.mm.yyyy HH:MM", Kyiv time), or default."""
+    try:
+        update = datetime.datetime.strptime(fact_json.get('update', ''), '%d.%m.%Y %H:%M')
+    except (TypeError, ValueError):
+        return int(default)
+    if DTEK_TZ is None:
+        return int(time.mktime(update.timetuple()))
+    return int(update.replace(tzinfo=DTEK_TZ).timestamp())
+
+
+class DisconScheduleScanner:
+    """
+    Incremental parser for the `DisconSchedule.<name> = {...}` assignments
+    embedded in the shutdowns page. Feed it HTML chunks as they arrive; it
+    stops needing data as soon as every requested object has been read, so
+    the rest of the page never has to be downloaded.
+    """
+    
+    def __init__(self, names=('preset', 'fact')):
+        self.results = {}
+        self._pending = list(names)
+        self._buffer = ''
+        self._object = None  # Characters of the object being collected
+        self._name = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+    
+    @property
+    def done(self):
+        return not self._pending and self._object is None
+    
+    def feed(self, chunk):
+        """Consume the next chunk of HTML text."""
+        self._buffer += chunk
+        while self._buffer and not self.done:
+            if self._object is None:
+                if not self._find_start():
+                    return
+            else:
+                self._collect()
+    
+    def _find_start(self):
+        best = None
+        for name in self._pending:
+            pos = self._buffer.find(f'DisconSchedule.{name}')
+            if pos >= 0 and (best is None or pos < best[0]):
+                best = (pos, name)
+        if best is None:
+            # Keep a tail in case a marker is split across chunks
+            self._buffer = self._buffer[-40:]
+            return False
+        
+        pos, name = best
+        rest = self._buffer[pos + len(f'DisconSchedule.{name}'):]
+        stripped = rest.lstrip()
+        if not stripped:
+            return False  # Need more data to see what follows the name
+        if not stripped.startswith('='):
+            # A reference to the object, not its assignment
+            self._buffer = rest
+            return True
+        value = stripped[1:].lstrip()
+        if not value:
+            return False
+        if not value.startswith('{'):
+            self._buffer = value
+            return True
+        
+        self._pending.remove(name)
+        self._name = name
+        self._object = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._buffer = value
+        return True
+    
+    def _collect(self):
+        text = self._buffer
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._object.append(text[:i + 1])
+                    self._finish()
+                    self._buffer = text[i + 1:]
+                    return
+        self._object.append(text)
+        self._buffer = ''
+    
+    def _finish(self):
+        try:
+            self.results[self._name] = json.loads(''.join(self._object))
+        except ValueError as e:
+            print(f"Warning: Could not parse DisconSchedule.{self._name}: {e}")
+        self._object = None
+        self._name = None
+
+
+def decode_chunks(chunks):
+    """UTF-8 text out of an iterable of byte chunks, keeping characters split between chunks whole."""
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+
+def parse_discon_schedule(chunks):
+    """Parse (preset, fact) out of an iterable of HTML text chunks."""
+    scanner = DisconScheduleScanner()
+    for chunk in chunks:
+        scanner.feed(chunk)
+        if scanner.done:
+            break
+    return scanner.results.get('preset'), scanner.results.get('fact')
+
+
+def is_valid_schedule(preset_json, fact_json):
+    """Sanity-check extracted objects before trusting them."""
+    if not isinstance(preset_json, dict) or not isinstance(fact_json, dict):
+        return False
+    fact_data = fact_json.get('data')
+    if not isinstance(fact_data, dict) or not fact_data:
+        return False
+    if not all(key.isdigit() and isinstance(day, dict) for key, day in fact_data.items()):
+        return False
+    return isinstance(preset_json.get('data'), dict)
+
+
+def parse_schedule_for_queue(fact_json, queue, timestamp):
+    """Parse schedule for a specific queue and timestamp."""
+    timestamp_str = str(timestamp)
+    
+    if timestamp_str not in fact_json.get('data', {}):
+        return None
+    
+    queue_data = fact_json['data'][timestamp_str].get(queue, {})
+    if not queue_data:
+        return None
+    
+    schedule = []
+    for hour in range(24):
+        hour_str = str(hour + 1)
+        status = queue_data.get(hour_str, 'unknown')
+        schedule.append({
+            'hour': hour,
+            'status': status
+        })
+    
+    return schedule
+
+
+# Status codes used by the simple (ESP32) format
+STATUS_MAP = {
+    'yes': 1,
+    'no': 0,
+    'first': 2,
+    'second': 3
+}
+
+
+def get_today_timestamp(fact_json):
+    """Timestamp of today's schedule, as given by DTEK or computed locally."""
+    today_timestamp = fact_json.get('today')
+    if not today_timestamp:
+        today = datetime.date.today()
+        today_timestamp = int(time.mktime(today.timetuple()))
+    return today_timestamp
+
+
+def build_schedule(fact_json, queue, days):
+    """Build the /schedule response for a queue. Returns (result, status)."""
+    today_timestamp = get_today_timestamp(fact_json)
+    
+    result = {
+        'queue': queue,
+        'update_time': fact_json.get('update', 'unknown'),
+        'days': []
+    }
+    
+    # Get schedule for requested number of days
+    for day_offset in range(days):
+        day_timestamp = today_timestamp + (day_offset * 86400)
+        schedule = parse_schedule_for_queue(fact_json, queue, day_timestamp)
+        
+        if schedule:
+            day_date = datetime.datetime.fromtimestamp(day_timestamp)
+            result['days'].append({
+                'date': day_date.strftime('%Y-%m-%d'),
+                'day_name': day_date.strftime('%A'),
+                'timestamp': day_timestamp,
+                'schedule': schedule
+            })
+    
+    if not result['days']:
+        return {
+            'error': 'No data available',
+            'message': f'No schedule data found for queue {queue}'
+        }, 404
+    
+    return result, 200
+
+
+def build_schedule_simple(fact_json, queue, days):
+    """Build the /schedule/simple response for a queue. Returns (result, status)."""
+    today_timestamp = get_today_timestamp(fact_json)
+    
+    result = {
+        'q': queue,
+        'd': []
+    }
+    
+    for day_offset in range(days):
+        day_timestamp = today_timestamp + (day_offset * 86400)
+        timestamp_str = str(day_timestamp)
+        
+        if timestamp_str in fact_json.get('data', {}):
+            queue_data = fact_json['data'][timestamp_str].get(queue, {})
+            if queue_data:
+                day_schedule = []
+                for hour in range(24):
+                    hour_str = str(hour + 1)
+                    status = queue_data.get(hour_str, 'unknown')
+                    day_schedule.append(STATUS_MAP.get(status, -1))
+                result['d'].append(day_schedule)
+    
+    return result, 200
+
+
+# Status codes of the preset (DTEK's planned weekly schedule): the simple format's
+# codes plus the "possible outage" variants that only appear in the plan
+PRESET_STATUS_MAP = dict(STATUS_MAP, maybe=4, mfirst=5, msecond=6)
+FORECAST_MAX_DAYS = 14
+
+
+def compile_weekly(preset_json):
+    """Preset as {queue: {ISO weekday (1=Monday): [24 status codes]}}."""
+    weekly = {}
+    for queue, weekdays in (preset_json or {}).get('data', {}).items():
+        if not isinstance(weekdays, dict):
+            continue
+        weekly[queue] = {
+            int(weekday): [PRESET_STATUS_MAP.get(hours.get(str(hour + 1)), -1) for hour in range(24)]
+            for weekday, hours in weekdays.items() if weekday.isdigit() and isinstance(hours, dict)
+        }
+    return weekly
+
+
+def build_forecast(fact_json, weekly, queue, days):
+    """
+    Build the /schedule/forecast response for a queue. Returns (result, status).
+    Days DTEK published a schedule for come from the fact, the rest from the
+    weekly plan for that weekday.
+    """
+    today_timestamp = get_today_timestamp(fact_json)
+    queue_weekly = weekly.get(queue, {})
+    
+    result = {
+        'queue': queue,
+        'update_time': fact_json.get('update', 'unknown'),
+        'days': []
+    }
+    
+    for day_offset in range(days):
+        day_timestamp = today_timestamp + (day_offset * 86400)
+        day_date = datetime.datetime.fromtimestamp(day_timestamp)
+        queue_data = fact_json.get('data', {}).get(str(day_timestamp), {}).get(queue)
+        
+        if queue_data:
+            source = 'fact'
+            hours = [STATUS_MAP.get(queue_data.get(str(hour + 1), 'unknown'), -1) for hour in range(24)]
+        elif day_date.isoweekday() in queue_weekly:
+            source = 'preset'
+            hours = queue_weekly[day_date.isoweekday()]
+        else:
+            continue
+        
+        result['days'].append({
+            'date': day_date.strftime('%Y-%m-%d'),
+            'day_name': day_date.strftime('%A'),
+            'timestamp': day_timestamp,
+            'source': source,
+            'h': hours
+        })
+    
+    if not result['days']:
+        return {
+            'error': 'No data available',
+            'message': f'No schedule data found for queue {queue}'
+        }, 404
+    
+    return result, 200
+
+
+# Packed binary format (/schedule/packed), version 1:
+#   byte 0: version << 4 | flags (bit 0 set = multi-queue)
+#   single: [ndays][ndays * 9 bytes of hours][crc8]
+#   multi:  [nqueues] then per queue [name length][name][ndays][hours], then [crc8]
+# Each hour is 3 bits, packed LSB first, 24 hours (9 bytes) per day. Codes are the
+# simple format's status codes (0-3); 7 means unknown (-1 in the simple format).
+PACKED_VERSION = 1
+PACKED_FLAG_MULTI = 0x01
+PACKED_UNKNOWN = 7
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data):
+    """CRC-8/SMBUS (poly 0x07, init 0x00)."""
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def pack_days(days):
+    """Pack lists of 24 simple status codes into [ndays][3-bit hours]."""
+    bits = 0
+    for i, code in enumerate(code for day in days for code in day):
+        bits |= (code if 0 <= code < PACKED_UNKNOWN else PACKED_UNKNOWN) << (3 * i)
+    return bytes([len(days)]) + bits.to_bytes(len(days) * 9, 'little')
+
+
+def unpack_days(data, offset):
+    """Inverse of pack_days. Returns (days, new offset)."""
+    if offset >= len(data):
+        raise ValueError('Truncated packed schedule')
+    ndays = data[offset]
+    end = offset + 1 + ndays * 9
+    if end > len(data):
+        raise ValueError('Truncated packed schedule')
+    bits = int.from_bytes(data[offset + 1:end], 'little')
+    days = []
+    for day in range(ndays):
+        codes = []
+        for hour in range(24):
+            code = (bits >> (3 * (day * 24 + hour))) & 0x07
+            codes.append(-1 if code == PACKED_UNKNOWN else code)
+        days.append(codes)
+    return days, end
+
+
+def encode_packed(fact_json, queue, days):
+    """Packed single-queue response: same data as /schedule/simple."""
+    result, _ = build_schedule_simple(fact_json, queue, days)
+    body = bytes([PACKED_VERSION << 4]) + pack_days(result['d'])
+    return body + bytes([crc8(body)])
+
+
+def encode_packed_multi(queue_bodies):
+    """Combine single-queue packed bodies [(queue, body)] into a multi-queue one."""
+    parts = [bytes([PACKED_VERSION << 4 | PACKED_FLAG_MULTI, len(queue_bodies)])]
+    for queue, body in queue_bodies:
+        name = queue.encode('utf-8')[:255]
+        parts.append(bytes([len(name)]) + name + body[1:-1])
+    body = b''.join(parts)
+    return body + bytes([crc8(body)])
+
+
+def decode_packed(data):
+    """
+    Reference decoder for /schedule/packed. Returns {'version', 'days'} for a
+    single-queue payload or {'version', 'queues': {queue: days}} for multi-queue,
+    where days are lists of simple status codes. Raises ValueError if invalid.
+    """
+    if len(data) < 3 or crc8(data[:-1]) != data[-1]:
+        raise ValueError('Bad packed schedule CRC')
+    version, flags = data[0] >> 4, data[0] & 0x0F
+    if version != PACKED_VERSION:
+        raise ValueError(f'Unsupported packed schedule version {version}')
+    
+    payload = data[:-1]
+    if not flags & PACKED_FLAG_MULTI:
+        days, _ = unpack_days(payload, 1)
+        return {'version': version, 'days': days}
+    
+    queues = {}
+    offset = 2
+    for _ in range(payload[1]):
+        if offset >= len(payload) or offset + 1 + payload[offset] > len(payload):
+            raise ValueError('Truncated packed schedule')
+        name_length = payload[offset]
+        name = payload[offset + 1:offset + 1 + name_length].decode('utf-8')
+        queues[name], offset = unpack_days(payload, offset + 1 + name_length)
+    return {'version': version, 'queues': queues}
+
+
+# Fact matrix: the published days as uint8 [day, queue, hour] of the simple format's
+# status codes (PACKED_UNKNOWN where a queue has no data), 24 bytes per queue and day
+# instead of a dict of 24 strings. Each status code's outage as (first half, second half)
+OUTAGE_HALVES = {0: (1, 1), 1: (0, 0), 2: (1, 0), 3: (0, 1)}
+POWER_GROUPS = {1: 'on', 2: 'partial', 3: 'partial', 0: 'off'}
+
+
+def compile_fact_matrix(fact_json):
+    """
+    {'days': [timestamps], 'queues': [names], 'codes': matrix}; the matrix is
+    a NumPy array, or a flat array('B') in [day, queue, hour] order without NumPy.
+    """
+    fact_data = fact_json.get('data', {})
+    days = sorted(int(key) for key in fact_data if key.isdigit())
+    queues = sorted({queue for day in fact_data.values() for queue in day})
+    codes = array('B', [PACKED_UNKNOWN]) * (len(days) * len(queues) * 24)
+    for d, day in enumerate(days):
+        day_data = fact_data[str(day)]
+        for q, queue in enumerate(queues):
+            hours = day_data.get(queue)
+            if not isinstance(hours, dict):
+                continue
+            base = (d * len(queues) + q) * 24
+            for hour in range(24):
+                codes[base + hour] = STATUS_MAP.get(hours.get(str(hour + 1)), PACKED_UNKNOWN)
+    
+    if USE_NUMPY:
+        codes = np.frombuffer(codes, dtype=np.uint8).reshape(len(days), len(queues), 24)
+    return {'days': days, 'queues': queues, 'codes': codes}
+
+
+def _matrix_stats_numpy(codes):
+    """(outage hours [day][queue], longest outage (half hours, first half hour) per queue)."""
+    ndays, nqueues = codes.shape[:2]
+    halves = np.zeros((256, 2), dtype=np.int8)
+    for code, outage in OUTAGE_HALVES.items():
+        halves[code] = outage
+    off = halves[codes].reshape(ndays, nqueues, 48)
+    outage_hours = off.sum(axis=2) / 2
+    
+    # Runs of outage half hours per queue, across midnight: edges of the zero-padded series
+    series = np.zeros((nqueues, ndays * 48 + 2), dtype=np.int8)
+    series[:, 1:-1] = off.transpose(1, 0, 2).reshape(nqueues, ndays * 48)
+    edges = np.diff(series, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    lengths = ends - starts
+    longest = [(0, None)] * nqueues
+    if len(rows):
+        # Longest run per queue (the earliest on ties): first of each queue's group
+        order = np.lexsort((starts, -lengths, rows))
+        first = order[np.r_[True, rows[order][1:] != rows[order][:-1]]]
+        for row, length, start in zip(rows[first], lengths[first], starts[first]):
+            longest[row] = (int(length), int(start))
+    return outage_hours.tolist(), longest
+
+
+def _matrix_stats_python(codes, ndays, nqueues):
+    """_matrix_stats_numpy() over a flat array('B')."""
+    outage_hours = [[0.0] * nqueues for _ in range(ndays)]
+    longest = []
+    for q in range(nqueues):
+        best = (0, None)
+        run_start = None
+        half = 0
+        for d in range(ndays):
+            base = (d * nqueues + q) * 24
+            for code in codes[base:base + 24]:
+                for off in OUTAGE_HALVES.get(code, (0, 0)):
+                    outage_hours[d][q] += off / 2
+                    if off and run_start is None:
+                        run_start = half
+                    elif not off and run_start is not None:
+                        if half - run_start > best[0]:
+                            best = (half - run_start, run_start)
+                        run_start = None
+                    half += 1
+        if run_start is not None and half - run_start > best[0]:
+            best = (half - run_start, run_start)
+        longest.append(best)
+    return outage_hours, longest
+
+
+def matrix_stats(matrix, hour=None):
+    """
+    Outage analytics over every queue at once: hours without power per queue
+    and day, the longest continuous outage per queue (days are consecutive,
+    so an outage running past midnight counts as one), and with an hour, which
+    queues have power then (on), for half of it (partial) or not at all (off).
+    """
+    days, queues, codes = matrix['days'], matrix['queues'], matrix['codes']
+    if USE_NUMPY:
+        outage_hours, longest = _matrix_stats_numpy(codes)
+    else:
+        outage_hours, longest = _matrix_stats_python(codes, len(days), len(queues))
+    
+    result = {'days': [], 'longest_outage': {}}
+    for d, day in enumerate(days):
+        entry = {
+            'date': datetime.datetime.fromtimestamp(day).strftime('%Y-%m-%d'),
+            'timestamp': day,
+            'outage_hours': dict(zip(queues, outage_hours[d]))
+        }
+        if hour is not None:
+            at_hour = {'hour': hour, 'on': [], 'partial': [], 'off': [], 'unknown': []}
+            hour_codes = codes[d, :, hour] if USE_NUMPY else codes[d * len(queues) * 24 + hour::24][:len(queues)]
+            for queue, code in zip(queues, hour_codes):
+                at_hour[POWER_GROUPS.get(int(code), 'unknown')].append(queue)
+            entry['at_hour'] = at_hour
+        result['days'].append(entry)
+    
+    for queue, (length, start) in zip(queues, longest):
+        if not length:
+            result['longest_outage'][queue] = None
+            continue
+        start_time = days[start // 48] + start % 48 * 1800
+        result['longest_outage'][queue] = {'hours': length / 2, 'start': start_time, 'end': start_time + length * 1800}
+    return result
+
+
+def compile_transitions(matrix):
+    """
+    Per queue, when power goes on or off at half-hour resolution, as sorted
+    ([times], [power from then on]) for bisection. Power is 'on', 'off' or None
+    (unknown: no data for the day, or past the last published day); the first
+    entry is the start of the first day.
+    """
+    days, queues = matrix['days'], matrix['queues']
+    codes = matrix['codes'].tobytes()
+    transitions = {}
+    for q, queue in enumerate(queues):
+        times = []
+        powers = []
+        for d, day in enumerate(days):
+            base = (d * len(queues) + q) * 24
+            for hour, code in enumerate(codes[base:base + 24]):
+                for half, off in enumerate(OUTAGE_HALVES.get(code, (None, None))):
+                    power = None if off is None else 'off' if off else 'on'
+                    if not powers or powers[-1] != power:
+                        times.append(day + hour * 3600 + half * 1800)
+                        powers.append(power)
+        if powers and powers[-1] is not None:
+            times.append(days[-1] + 86400)
+            powers.append(None)
+        transitions[queue] = (times, powers)
+    return transitions
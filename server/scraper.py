@@ -0,0 +1,815 @@
+#!/usr/bin/env python3
+"""
+Fetching DTEK schedule data: plain HTTP with cookies harvested from a browser
+first, a pool of warm Chromium sessions (undetected-chromedriver, or Selenium)
+when that fails.
+
+The browser stack is imported on first use, so processes that never scrape
+(gunicorn workers serving from the snapshot store) do not pay for it.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import urllib3
+
+from metrics import Metrics
+from schedule import decode_chunks, is_valid_schedule, parse_discon_schedule
+
+# undetected_chromedriver, or selenium's webdriver and Options without it (see load_webdriver)
+webdriver_modules = {}
+
+
+def load_webdriver():
+    """Import the browser automation modules (once, on the first browser launch)."""
+    if not webdriver_modules:
+        try:
+            import undetected_chromedriver as uc
+            webdriver_modules['uc'] = uc
+        except ImportError:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+            webdriver_modules.update(webdriver=webdriver, Options=Options)
+    return webdriver_modules
+
+
+# DTEK regional sites serving the DisconSchedule shutdowns page
+REGION_URLS = {
+    'dnem': 'https://www.dtek-dnem.com.ua/ua/shutdowns',  # Dnipro region
+    'kem': 'https://www.dtek-kem.com.ua/ua/shutdowns',  # Kyiv
+    'krem': 'https://www.dtek-krem.com.ua/ua/shutdowns',  # Kyiv region
+    'oem': 'https://www.dtek-oem.com.ua/ua/shutdowns',  # Odesa region
+    'dem': 'https://www.dtek-dem.com.ua/ua/shutdowns'  # Donetsk region
+}
+
+
+def parse_regions(spec):
+    """
+    Regions to serve from a comma-separated list of registry names or
+    name=url pairs (new regions, or a local stand-in page for a known one).
+    """
+    regions = {}
+    for item in spec.split(','):
+        name, _, url = item.strip().partition('=')
+        if not name:
+            continue
+        if not url and name not in REGION_URLS:
+            raise ValueError(f"Unknown region {name!r}, known: {', '.join(REGION_URLS)}")
+        regions[name] = url or REGION_URLS[name]
+    if not regions:
+        raise ValueError('No regions configured')
+    return regions
+
+
+# Regions scraped and served; the first one is used when a request has no region=
+REGIONS = parse_regions(os.environ.get('REGIONS', 'dnem'))
+DEFAULT_REGION = next(iter(REGIONS))
+
+# Warm browser sessions kept alive between refreshes (also bounds concurrent browser scrapes)
+BROWSER_POOL_SIZE = int(os.environ.get('BROWSER_POOL_SIZE', str(min(len(REGIONS), 3))))
+BROWSER_MAX_USES = int(os.environ.get('BROWSER_MAX_USES', '50'))  # Recycle after N scrapes
+BROWSER_MAX_RSS_GROWTH_MB = int(os.environ.get('BROWSER_MAX_RSS_GROWTH_MB', '200'))  # Recycle on memory growth
+BROWSER_IDLE_TIMEOUT = int(os.environ.get('BROWSER_IDLE_TIMEOUT', '900'))  # Close sessions the fast path made idle
+
+# Watchdog limits: a session whose process tree (chromedriver and Chromium) goes over
+# BROWSER_MAX_RSS_MB, or that is stuck in one scrape for SCRAPE_TIMEOUT seconds, is killed
+# and replaced by a new one on the next scrape
+BROWSER_MAX_RSS_MB = int(os.environ.get('BROWSER_MAX_RSS_MB', '1024'))
+SCRAPE_TIMEOUT = int(os.environ.get('SCRAPE_TIMEOUT', '180'))
+WATCHDOG_INTERVAL = 5
+# Prefixes of the (15 character) /proc command names of chromedriver and Chromium processes
+BROWSER_PROCESS_NAMES = ('chrome', 'chromium', 'undetected_chro', 'headless_shell')
+
+# Browser profile: 'lean' blocks images, fonts, stylesheets, media and third-party
+# scripts, returns from page loads at DOMContentLoaded and caps renderer memory;
+# 'full' loads the page like a desktop browser. Lean falls back to full for a while
+# if lean scrapes keep failing (e.g. an Incapsula challenge that needs a blocked resource).
+SCRAPE_PROFILE = os.environ.get('SCRAPE_PROFILE', 'lean')
+SCRAPE_JS_HEAP_MB = int(os.environ.get('SCRAPE_JS_HEAP_MB', '128'))  # Renderer V8 heap cap (lean)
+SCRAPE_BLOCKED_URLS = [
+    # Resource types the schedule does not need (only the page's inline scripts and Incapsula's)
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*.css', '*.mp4', '*.webm', '*.mp3',
+    # Analytics, maps, chat and social widgets
+    '*google-analytics.com*', '*googletagmanager.com*', '*/gtag/js*', '*doubleclick.net*',
+    '*maps.googleapis.com*', '*maps.gstatic.com*', '*/maps/api/js*', '*fonts.googleapis.com*',
+    '*fonts.gstatic.com*', '*facebook.net*', '*connect.facebook.com*', '*youtube.com*', '*ytimg.com*',
+    '*hotjar.com*', '*mc.yandex.*', '*binotel.com*', '*jivosite.com*', '*tawk.to*'
+] + [pattern for pattern in os.environ.get('SCRAPE_BLOCKED_URLS', '').split(',') if pattern]
+
+# Seconds a browser scrape waits for DisconSchedule after loading the page. The wait
+# adapts (up to READY_TIMEOUT_MAX): 3x the slowest recent page, doubled after each timeout.
+READY_TIMEOUT = float(os.environ.get('READY_TIMEOUT', '30'))
+READY_TIMEOUT_MAX = float(os.environ.get('READY_TIMEOUT_MAX', '120'))
+
+# Plain HTTP client for the browserless fast path (cookies come from the browser)
+http_pool = urllib3.PoolManager(
+    num_pools=max(2, len(REGIONS)),
+    maxsize=2,
+    retries=False,
+    timeout=urllib3.Timeout(connect=5, read=10)
+)
+
+# State shared by every process on this host: harvested cookies here, and
+# server.py's snapshot store and refresher lock
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'dtek-display'))
+
+# Prometheus metrics, served on /metrics by server.py (which adds its own to this registry).
+# Every worker writes its own file here; a scrape sums them.
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(SNAPSHOT_DIR, 'metrics'))
+SCRAPE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+metrics = Metrics(METRICS_DIR)
+metrics.histogram('dtek_scrape_phase_seconds',
+                  'Time spent in each scrape phase (launch, navigate, ready, extract, fast_fetch)',
+                  SCRAPE_BUCKETS)
+metrics.counter('dtek_fetches_total', 'Schedule fetches by method (fast, browser) and result')
+metrics.counter('dtek_browser_kills_total', 'Browser process trees killed by the watchdog, by reason '
+                '(timeout, memory, orphan)')
+
+
+def find_chromedriver():
+    """Find ChromeDriver executable in common locations or PATH."""
+    # Check PATH first (most universal)
+    chromedriver_path = shutil.which('chromedriver')
+    if chromedriver_path:
+        return chromedriver_path
+    
+    # Common system locations
+    common_paths = [
+        '/usr/bin/chromedriver',
+        '/usr/local/bin/chromedriver',
+        '/snap/bin/chromium.chromedriver',
+    ]
+    
+    for path in common_paths:
+        if os.path.exists(path) and os.access(path, os.X_OK):
+            return path
+    
+    # Return None to let undetected-chromedriver auto-download (may fail on ARM)
+    return None
+
+
+def find_chromium_binary():
+    """Find Chromium binary in common locations or PATH."""
+    # Check PATH first
+    chromium_path = shutil.which('chromium-browser') or shutil.which('chromium')
+    if chromium_path:
+        return chromium_path
+    
+    # Common system locations
+    common_paths = [
+        '/usr/bin/chromium-browser',
+        '/usr/bin/chromium',
+        '/snap/bin/chromium',
+    ]
+    
+    for path in common_paths:
+        if os.path.exists(path) and os.access(path, os.X_OK):
+            return path
+    
+    return None
+
+
+# Lean sessions failing in a row, and until when new sessions use the full profile instead
+scrape_profile = {
+    'lean_failures': 0,
+    'max_lean_failures': 3,
+    'fallback_until': 0,
+    'fallback_duration': 6 * 3600
+}
+
+
+def current_profile():
+    """Profile for a new browser session (see SCRAPE_PROFILE)."""
+    if SCRAPE_PROFILE == 'lean' and time.time() >= scrape_profile['fallback_until']:
+        return 'lean'
+    return 'full'
+
+
+def record_profile_result(profile, ok):
+    """Track lean scrape outcomes; repeated failures switch new sessions to the full profile."""
+    if profile != 'lean':
+        return
+    if ok:
+        scrape_profile['lean_failures'] = 0
+        return
+    scrape_profile['lean_failures'] += 1
+    if scrape_profile['lean_failures'] >= scrape_profile['max_lean_failures']:
+        scrape_profile['lean_failures'] = 0
+        scrape_profile['fallback_until'] = time.time() + scrape_profile['fallback_duration']
+        print(f"Lean scrapes keep failing, using the full browser profile for "
+              f"{scrape_profile['fallback_duration'] // 3600}h")
+
+
+def add_lean_options(options):
+    """Chrome options of the lean profile."""
+    options.page_load_strategy = 'eager'  # driver.get() returns at DOMContentLoaded
+    for argument in (
+        '--blink-settings=imagesEnabled=false',
+        f'--js-flags=--max-old-space-size={SCRAPE_JS_HEAP_MB}',
+        '--renderer-process-limit=1',
+        '--disable-gpu',
+        '--disable-extensions',
+        '--disable-background-networking',
+        '--disable-component-update',
+        '--disable-sync',
+        '--disable-features=Translate,MediaRouter,OptimizationHints',
+        '--mute-audio'
+    ):
+        options.add_argument(argument)
+
+
+def block_resources(driver):
+    """Block SCRAPE_BLOCKED_URLS in the session's tab (kept across reloads)."""
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': SCRAPE_BLOCKED_URLS})
+
+
+def setup_driver(profile=None):
+    """Setup Chrome driver with options to avoid detection, in the given (or current) profile."""
+    profile = profile or current_profile()
+    browser = load_webdriver()
+    if 'uc' in browser:
+        options = browser['uc'].ChromeOptions()
+        options.add_argument('--headless')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        if profile == 'lean':
+            add_lean_options(options)
+        
+        # Find Chromium binary and ChromeDriver
+        chromium_binary = find_chromium_binary()
+        chromedriver_path = find_chromedriver()
+        
+        # Set Chromium binary location if found
+        if chromium_binary:
+            options.binary_location = chromium_binary
+        
+        # Use system ChromeDriver if found
+        if chromedriver_path:
+            driver = browser['uc'].Chrome(options=options, driver_executable_path=chromedriver_path, version_main=None)
+        else:
+            # Fallback: let it auto-download (may fail on ARM)
+            driver = browser['uc'].Chrome(options=options, version_main=None)
+    else:
+        chrome_options = browser['Options']()
+        chrome_options.add_argument('--headless')
+        chrome_options.add_argument('--no-sandbox')
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        chrome_options.add_experimental_option('useAutomationExtension', False)
+        chrome_options.add_argument('user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
+        if profile == 'lean':
+            add_lean_options(chrome_options)
+        
+        driver = browser['webdriver'].Chrome(options=chrome_options)
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
+            'source': 'Object.defineProperty(navigator, "webdriver", {get: () => undefined})'
+        })
+    
+    if profile == 'lean':
+        try:
+            block_resources(driver)
+        except Exception as e:
+            print(f"Warning: Could not block resources: {e}")
+    return driver
+
+
+# Resolves as soon as the page has defined both schedule objects and returns them
+# together, so readiness and extraction are one round trip with no polling from Python.
+WAIT_FOR_SCHEDULE_JS = """
+    var done = arguments[arguments.length - 1];
+    var deadline = Date.now() + arguments[0];
+    (function check() {
+        var ready = false;
+        try {
+            ready = typeof DisconSchedule !== 'undefined' && DisconSchedule.fact && DisconSchedule.preset;
+        } catch (e) {}
+        if (ready) {
+            done(JSON.stringify({preset: DisconSchedule.preset, fact: DisconSchedule.fact}));
+        } else if (Date.now() >= deadline) {
+            done(null);
+        } else {
+            setTimeout(check, 25);
+        }
+    })();
+"""
+
+# Recent readiness waits, for the adaptive timeout
+readiness = {
+    'latencies': deque(maxlen=20),  # Seconds from page load to DisconSchedule of recent successes
+    'timeouts': 0  # Readiness timeouts in a row
+}
+
+
+def ready_timeout():
+    """Current readiness timeout (see READY_TIMEOUT)."""
+    slowest = max(readiness['latencies'], default=0)
+    return min(READY_TIMEOUT_MAX, max(READY_TIMEOUT, 3 * slowest) * 2 ** readiness['timeouts'])
+
+
+def wait_for_page_schedule(driver, timeout=None):
+    """
+    Wait in the page until DisconSchedule.fact and .preset exist and return
+    both as one JSON string ({"preset", "fact"}), or None on timeout.
+    
+    A page that navigates while we wait (an Incapsula challenge reloading
+    itself) aborts the script; the wait then resumes in the new document.
+    """
+    timeout = timeout or ready_timeout()
+    started = time.monotonic()
+    deadline = started + timeout
+    result = None
+    errors = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            driver.set_script_timeout(remaining + 5)
+            result = driver.execute_async_script(WAIT_FOR_SCHEDULE_JS, int(remaining * 1000))
+            break
+        except Exception as e:
+            errors += 1
+            if errors >= 20:
+                print(f"Warning: Gave up waiting for DisconSchedule: {e}")
+                break
+            time.sleep(0.1)
+    
+    latency = time.monotonic() - started
+    metrics.observe('dtek_scrape_phase_seconds', latency, phase='ready')
+    if result:
+        readiness['latencies'].append(latency)
+        readiness['timeouts'] = 0
+        print(f"DisconSchedule ready after {latency:.2f}s")
+    else:
+        readiness['timeouts'] = min(readiness['timeouts'] + 1, 8)
+        print(f"DisconSchedule not ready after {latency:.0f}s (next wait: {ready_timeout():.0f}s)")
+    return result
+
+
+def parse_schedule_json(text):
+    """(preset_json, fact_json) from wait_for_page_schedule()'s result."""
+    if not text:
+        return None, None
+    with metrics.timer('dtek_scrape_phase_seconds', phase='extract'):
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            print(f"Warning: Could not parse DisconSchedule JSON: {e}")
+            return None, None
+    return data.get('preset'), data.get('fact')
+
+
+# Cookies and user agent harvested from the last successful browser session,
+# per site host ({host: {'cookies', 'user_agent'}}): each regional site has its own
+fast_path = {}
+
+
+def site_host(url):
+    """Host name of a URL (cookies are kept per host)."""
+    return urllib3.util.parse_url(url).host or ''
+
+
+def cookie_file(host):
+    return os.path.join(SNAPSHOT_DIR, f'cookies.{host}.json')
+
+
+def harvest_cookies(driver):
+    """Remember a browser session's cookies so plain HTTP requests can reuse them."""
+    try:
+        host = site_host(driver.current_url)
+        site = {
+            'cookies': {c['name']: c['value'] for c in driver.get_cookies()},
+            'user_agent': driver.execute_script('return navigator.userAgent;')
+        }
+    except Exception as e:
+        print(f"Warning: Could not harvest cookies: {e}")
+        return
+    
+    fast_path[host] = site
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(cookie_file(host), 'w', encoding='utf-8') as f:
+            json.dump(site, f)
+    except OSError as e:
+        print(f"Warning: Could not save cookies: {e}")
+
+
+def load_cookies(host):
+    """Load cookies saved by a previous browser session (possibly another process)."""
+    try:
+        with open(cookie_file(host), encoding='utf-8') as f:
+            saved = json.load(f)
+        fast_path[host] = {
+            'cookies': saved.get('cookies'),
+            'user_agent': saved.get('user_agent')
+        }
+    except (OSError, ValueError):
+        pass
+
+
+def fetch_schedule_data_fast(url):
+    """
+    Fetch the shutdowns page over plain HTTP with harvested browser cookies
+    and parse DisconSchedule straight out of the HTML. Returns None when there
+    are no cookies, they were rejected, or the data does not validate.
+    """
+    host = site_host(url)
+    if not fast_path.get(host, {}).get('cookies'):
+        load_cookies(host)
+    site = fast_path.get(host)
+    if not site or not site['cookies']:
+        return None
+    
+    headers = {
+        'User-Agent': site['user_agent'] or 'Mozilla/5.0',
+        'Accept': 'text/html,application/xhtml+xml',
+        'Accept-Language': 'uk,en;q=0.8',
+        'Cookie': '; '.join(f'{name}={value}' for name, value in site['cookies'].items())
+    }
+    
+    response = None
+    try:
+        with metrics.timer('dtek_scrape_phase_seconds', phase='fast_fetch'):
+            response = http_pool.request('GET', url, headers=headers, preload_content=False)
+            if response.status != 200:
+                print(f"Fast path: HTTP {response.status}")
+                preset_json, fact_json = None, None
+            else:
+                chunks = decode_chunks(response.stream(16384, decode_content=True))
+                preset_json, fact_json = parse_discon_schedule(chunks)
+    except Exception as e:
+        print(f"Fast path error: {e}")
+        preset_json, fact_json = None, None
+    finally:
+        if response is not None:
+            response.release_conn()
+    
+    if not is_valid_schedule(preset_json, fact_json):
+        # Most likely an Incapsula challenge: cookies expired
+        print(f"Fast path failed validation for {host}, falling back to browser")
+        site['cookies'] = None
+        metrics.inc('dtek_fetches_total', method='fast', result='failed')
+        return None
+    
+    metrics.inc('dtek_fetches_total', method='fast', result='ok')
+    return {
+        'preset': preset_json,
+        'fact': fact_json
+    }
+
+
+def process_table():
+    """{pid: (ppid, command name, state, resident bytes)} of every process on the host. Linux only."""
+    table = {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    try:
+        proc_ids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return table
+    
+    for proc_id in proc_ids:
+        try:
+            with open(f'/proc/{proc_id}/stat') as f:
+                stat = f.read()
+            with open(f'/proc/{proc_id}/statm') as f:
+                statm = f.read()
+        except OSError:
+            continue
+        # The command name is parenthesised (and may contain spaces); then state, ppid, ...
+        name, fields = stat[stat.index('(') + 1:].rsplit(')', 1)
+        state, ppid = fields.split()[:2]
+        table[proc_id] = (int(ppid), name, state, int(statm.split()[1]) * page_size)
+    return table
+
+
+def process_tree(table, pids):
+    """The given processes and all their descendants, from a process_table()."""
+    children = {}
+    for proc_id, (ppid, _, _, _) in table.items():
+        children.setdefault(ppid, []).append(proc_id)
+    tree = set()
+    pending = [pid for pid in pids if pid]
+    while pending:
+        proc_id = pending.pop()
+        if proc_id not in tree:
+            tree.add(proc_id)
+            pending.extend(children.get(proc_id, []))
+    return tree
+
+
+def driver_pids(driver):
+    """
+    PIDs of the processes behind a driver: chromedriver, and the browser when
+    the driver starts it itself (undetected-chromedriver does).
+    """
+    service = getattr(driver, 'service', None)
+    process = getattr(service, 'process', None)
+    pids = (getattr(process, 'pid', None), getattr(driver, 'browser_pid', None))
+    return [pid for pid in dict.fromkeys(pids) if pid]
+
+
+def driver_rss(driver, table=None):
+    """Resident memory (bytes) of every process behind a driver."""
+    table = process_table() if table is None else table
+    return sum(table[proc_id][3] for proc_id in process_tree(table, driver_pids(driver)) if proc_id in table)
+
+
+def kill_processes(pids):
+    """SIGKILL processes, skipping ones that are already gone."""
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def reap_orphans(table, live_pids):
+    """
+    Kill browser processes among this process's children that no live session
+    owns (left over when driver.quit() missed them, or reparented here from a
+    dead chromedriver when this process is a subreaper) and collect exited
+    children. Returns the number of processes killed.
+    """
+    me = os.getpid()
+    orphans = []
+    for proc_id, (ppid, name, state, _) in table.items():
+        if ppid != me or proc_id in live_pids:
+            continue
+        if state == 'Z':
+            try:
+                os.waitpid(proc_id, os.WNOHANG)
+            except ChildProcessError:
+                pass
+        elif name.startswith(BROWSER_PROCESS_NAMES):
+            orphans.append(proc_id)
+    
+    if orphans:
+        print(f"Watchdog: killing {len(orphans)} orphaned browser process(es)")
+        kill_processes(process_tree(table, orphans))
+        metrics.inc('dtek_browser_kills_total', len(orphans), reason='orphan')
+    return len(orphans)
+
+
+class BrowserPool:
+    """
+    Pool of warm browser sessions reused across refreshes.
+    
+    Reusing a session keeps Chromium running and keeps the Incapsula cookies,
+    so a refresh is a page reload instead of a browser launch plus challenge.
+    Sessions are health-checked before use and recycled after max_uses scrapes,
+    when their process tree grows by more than max_rss_growth bytes, or after
+    any failed scrape. Crashed sessions are replaced transparently.
+    
+    A watchdog thread (started with the first session) kills the process tree
+    of any session stuck in one scrape for scrape_timeout seconds or using more
+    than max_rss bytes, which fails a hung driver.get() instead of waiting on
+    it, and kills browser processes no session owns any more.
+    """
+    
+    def __init__(self, size, max_uses, max_rss_growth, max_rss, scrape_timeout):
+        self.max_uses = max_uses
+        self.max_rss_growth = max_rss_growth
+        self.max_rss = max_rss
+        self.scrape_timeout = scrape_timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._busy = {}  # id(session): session, for sessions lent out
+        self._owned = {}  # id(session): session, every session from launch until quit (idle, busy or in between)
+        self._creating = 0  # Sessions being launched (their processes are not known yet)
+        self._watchdog = None
+    
+    @contextmanager
+    def session(self):
+        """
+        Borrow a healthy session dict ({'driver', 'uses', ...}). Set
+        session['broken'] = True to have it discarded instead of returned.
+        """
+        self._slots.acquire()
+        session = None
+        try:
+            session = self._acquire()
+            session['busy_since'] = time.time()
+            with self._lock:
+                self._busy[id(session)] = session
+            yield session
+        except Exception:
+            if session is not None:
+                session['broken'] = True
+            raise
+        finally:
+            if session is not None:
+                with self._lock:
+                    self._busy.pop(id(session), None)
+                self._release(session)
+            self._slots.release()
+    
+    def close_idle(self, max_idle):
+        """Quit sessions that have not been used for max_idle seconds."""
+        now = time.time()
+        with self._lock:
+            expired = [session for session in self._idle if now - session['last_used'] > max_idle]
+            self._idle = [session for session in self._idle if session not in expired]
+        for session in expired:
+            print("Closing idle browser session")
+            self._quit(session)
+    
+    def close(self):
+        """Quit all idle sessions."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            self._quit(session)
+    
+    def enforce_limits(self):
+        """One watchdog pass over every session and this process's stray browser processes."""
+        table = process_table()
+        now = time.time()
+        with self._lock:
+            sessions = list(self._owned.values())
+            busy = set(self._busy)
+            creating = self._creating
+        
+        # Every owned session's processes are live, including one being handed
+        # over between the idle list and a scrape (health check, RSS scan)
+        live = set()
+        for session in sessions:
+            tree = process_tree(table, driver_pids(session['driver']))
+            live |= tree
+            rss = sum(table[proc_id][3] for proc_id in tree if proc_id in table)
+            if id(session) in busy and now - session['busy_since'] > self.scrape_timeout:
+                reason, detail = 'timeout', f"scrape running for {now - session['busy_since']:.0f}s"
+            elif rss > self.max_rss:
+                reason, detail = 'memory', f"{rss // (1024 * 1024)} MB"
+            else:
+                continue
+            
+            print(f"Watchdog: killing browser session ({detail})")
+            metrics.inc('dtek_browser_kills_total', reason=reason)
+            # A busy session's scrape fails and it is discarded on release; one being
+            # handed over fails its health check or is discarded on the next one
+            session['broken'] = True
+            with self._lock:
+                idle = any(session is other for other in self._idle)
+                self._idle = [other for other in self._idle if other is not session]
+            kill_processes(tree)
+            if idle:
+                self._quit(session)
+        
+        if not creating:
+            reap_orphans(table, live)
+    
+    def _acquire(self):
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                return self._create()
+            if self._is_healthy(session):
+                return session
+            print("Browser session is unhealthy, replacing it")
+            self._quit(session)
+    
+    def _release(self, session):
+        session['uses'] += 1
+        session['last_used'] = time.time()
+        reason = None
+        if session.get('broken'):
+            reason = 'failed scrape'
+        elif session['uses'] >= self.max_uses:
+            reason = f"{session['uses']} uses"
+        else:
+            rss = self._rss(session)
+            if session['base_rss'] is None:
+                session['base_rss'] = rss
+            elif rss - session['base_rss'] > self.max_rss_growth:
+                reason = f"memory growth to {rss // (1024 * 1024)} MB"
+        
+        if reason:
+            print(f"Recycling browser session ({reason})")
+            self._quit(session)
+        else:
+            with self._lock:
+                self._idle.append(session)
+    
+    def _create(self):
+        self.start_watchdog()
+        profile = current_profile()
+        print(f"Starting new browser session ({profile} profile)...")
+        with self._lock:
+            self._creating += 1
+        driver = None
+        try:
+            with metrics.timer('dtek_scrape_phase_seconds', phase='launch'):
+                driver = setup_driver(profile)
+        finally:
+            session = {
+                'driver': driver,
+                'profile': profile,
+                'uses': 0,
+                'last_used': time.time(),
+                'base_rss': None,
+                'broken': False
+            }
+            with self._lock:
+                # Owned before it stops counting as launching, so its processes are never orphans
+                if driver is not None:
+                    self._owned[id(session)] = session
+                self._creating -= 1
+        return session
+    
+    def _is_healthy(self, session):
+        try:
+            return session['driver'].execute_script('return 1;') == 1
+        except Exception:
+            return False
+    
+    def _rss(self, session):
+        return driver_rss(session['driver'])
+    
+    def start_watchdog(self):
+        """Start the watchdog thread (once); creating the first session also starts it."""
+        with self._lock:
+            if self._watchdog is not None:
+                return
+            self._watchdog = threading.Thread(target=self._watchdog_loop, name='browser-watchdog', daemon=True)
+        self._watchdog.start()
+    
+    def _watchdog_loop(self):
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            try:
+                self.enforce_limits()
+            except Exception as e:
+                print(f"Warning: Browser watchdog failed: {e}")
+    
+    def _quit(self, session):
+        try:
+            session['driver'].quit()
+        except Exception as e:
+            print(f"Warning: Could not quit browser session: {e}")
+        with self._lock:
+            self._owned.pop(id(session), None)
+
+
+browser_pool = BrowserPool(BROWSER_POOL_SIZE, BROWSER_MAX_USES, BROWSER_MAX_RSS_GROWTH_MB * 1024 * 1024,
+                           BROWSER_MAX_RSS_MB * 1024 * 1024, SCRAPE_TIMEOUT)
+atexit.register(browser_pool.close)
+
+
+def fetch_schedule_data(url=None):
+    """
+    Fetch schedule data from a DTEK site (default region if no url): plain
+    HTTP first, browser when the fast path has no valid cookies or its result
+    fails validation.
+    """
+    url = url or REGIONS[DEFAULT_REGION]
+    data = fetch_schedule_data_fast(url)
+    if data:
+        browser_pool.close_idle(BROWSER_IDLE_TIMEOUT)
+        return data
+    return fetch_schedule_data_browser(url)
+
+
+def fetch_schedule_data_browser(url):
+    """Fetch schedule data using a warm browser session."""
+    try:
+        with browser_pool.session() as session:
+            driver = session['driver']
+            # Reload in place on a warm session to reuse its Incapsula cookies
+            with metrics.timer('dtek_scrape_phase_seconds', phase='navigate'):
+                if session['uses'] and driver.current_url.startswith(url):
+                    driver.refresh()
+                else:
+                    driver.get(url)
+            
+            preset_json, fact_json = parse_schedule_json(wait_for_page_schedule(driver))
+            
+            if not preset_json or not fact_json:
+                session['broken'] = True
+                record_profile_result(session['profile'], False)
+                metrics.inc('dtek_fetches_total', method='browser', result='failed')
+                return None
+            
+            harvest_cookies(driver)
+            record_profile_result(session['profile'], True)
+            metrics.inc('dtek_fetches_total', method='browser', result='ok')
+            return {
+                'preset': preset_json,
+                'fact': fact_json
+            }
+        
+    except Exception as e:
+        print(f"Error fetching schedule: {e}")
+        metrics.inc('dtek_fetches_total', method='browser', result='failed')
+        return None
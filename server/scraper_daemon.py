@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Scraper daemon: all scraping for this host, outside the API workers.
+
+Run it next to the API server, with SCRAPER_DAEMON=1 set for the server. It
+takes the refresher lock in SNAPSHOT_DIR and publishes every refresh to the
+snapshot store the workers already follow, so Chromium never runs inside a
+worker and a hung or bloated browser cannot slow down requests. The browser
+watchdog kills sessions that go over SCRAPE_TIMEOUT or BROWSER_MAX_RSS_MB
+(the next scrape starts a new one); as a child subreaper the daemon also gets,
+and kills, browser processes orphaned by a dead chromedriver.
+
+    python scraper_daemon.py
+"""
+
+import ctypes
+import signal
+import sys
+import time
+
+import scraper
+import server
+
+PR_SET_CHILD_SUBREAPER = 36
+
+
+def become_subreaper():
+    """Have orphaned descendants reparented to this process instead of init. Linux only."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def main():
+    if not become_subreaper():
+        print("Warning: Could not become a child subreaper, only direct children are reaped")
+    # Exit through atexit, which quits the pooled browsers, when the service manager stops us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    server.refresher['can_lead'] = True
+    if not server.try_become_leader():
+        print("Another process holds the refresher lock (is SCRAPER_DAEMON=1 set for the server?), waiting...")
+        while not server.try_become_leader():
+            time.sleep(5)
+    
+    scraper.browser_pool.start_watchdog()
+    server.refresher_loop()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,35 +4,162 @@ Flask web server to provide electricity shutdown schedule data.
 Designed for ESP32 consumption with simple password protection.
 """
 
+import bisect
+import gzip
 import json
+import math
+import random
 import time
 import datetime
 import os
-import shutil
-from flask import Flask, jsonify, request
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from collections import OrderedDict
+from flask import Flask, Response, g, jsonify, request
 from functools import wraps
+from werkzeug.http import http_date
+
+from archive import SnapshotArchive
+from schedule import (FORECAST_MAX_DAYS, STATUS_MAP, build_forecast, build_schedule, build_schedule_simple,
+                      compile_fact_matrix, compile_transitions, compile_weekly, encode_packed, encode_packed_multi,
+                      get_today_timestamp, matrix_stats, parse_update_time)
+from scraper import (DEFAULT_REGION, REGIONS, SCRAPE_BUCKETS, SNAPSHOT_DIR, fetch_schedule_data, metrics,
+                     ready_timeout)
 
 try:
-    import undetected_chromedriver as uc
-    USE_UNDETECTED = True
+    import brotli
+    USE_BROTLI = True
 except ImportError:
-    USE_UNDETECTED = False
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.common.exceptions import TimeoutException
+    USE_BROTLI = False  # gzip only
 
 app = Flask(__name__)
 
 # Simple password - can be set via environment variable or changed here
 API_PASSWORD = os.environ.get('API_PASSWORD', 'API_PASSWORD')
 
-# Cache for schedule data (to avoid hammering the DTEK website)
-cache = {
-    'data': None,
-    'timestamp': 0,
-    'ttl': 300  # Cache for 5 minutes
+# Long-poll waiters (/schedule/wait) sleep on this until a new snapshot is compiled
+snapshot_changed = threading.Condition()
+snapshot_listeners = []  # Callables run after each compile (e.g. to wake asyncio waiters)
+WAIT_MAX_TIMEOUT = 110  # Stay below common proxy read timeouts (120s)
+
+# Snapshot store shared by all gunicorn workers on this host (in SNAPSHOT_DIR, see scraper.py).
+# One worker (holding the lock file) refreshes and publishes; the rest only read.
+# With SCRAPER_DAEMON=1 no worker ever takes the lock: scraper_daemon.py holds it and
+# does all scraping, so no browser runs inside an API worker.
+SCRAPER_DAEMON = os.environ.get('SCRAPER_DAEMON', '0') == '1'
+LOCK_FILE = os.path.join(SNAPSHOT_DIR, 'refresher.lock')
+SNAPSHOT_KEYS = ('data', 'timestamp', 'generation', 'last_attempt', 'last_error', 'failures',
+                 'changes', 'change_seq', 'ttl', 'retry_at', 'update_hours', 'last_change', 'scrapes',
+                 'freshness_lag', 'queue_digests', 'queue_updates')
+
+# Adaptive refresh scheduling. Refreshes are spread over the day in proportion to the
+# square root of how often DTEK publishes at each hour (learned from `update` stamps),
+# which minimizes the average delay in noticing an update for a given number of scrapes.
+REFRESH_DAILY_BUDGET = int(os.environ.get('REFRESH_DAILY_BUDGET', '192'))  # Target scrapes per day and region
+REFRESH_MIN_INTERVAL = int(os.environ.get('REFRESH_MIN_INTERVAL', '60'))
+REFRESH_MAX_INTERVAL = int(os.environ.get('REFRESH_MAX_INTERVAL', '900'))
+RETRY_MAX_INTERVAL = int(os.environ.get('RETRY_MAX_INTERVAL', '1800'))  # Cap of the failure backoff
+# Starting profile until updates are observed: evenings (17:00-23:59), when next-day schedules come out
+UPDATE_HOURS_PRIOR = [0.5] * 17 + [3.0] * 7
+UPDATE_DECAY = 0.99  # Weight left to older updates each time one is observed
+
+# Sleep hints for battery clients (/schedule/next, X-Sleep-Hint on /schedule/simple):
+# sleep until the queue's next power change or the next hour DTEK usually publishes in,
+# but no longer than SLEEP_HINT_MAX seconds
+SLEEP_HINT_MIN = 60
+SLEEP_HINT_MAX = int(os.environ.get('SLEEP_HINT_MAX', '10800'))
+UPDATE_HORIZON_HOURS = 48  # Expected updates indexed per snapshot
+
+# Compressed response variants (Content-Encoding), in order of preference. Compressed
+# once per snapshot: eagerly for each queue's default request (PRECOMPRESSED), on first
+# use for anything else, kept in a per-region LRU of ENCODED_CACHE_SIZE bodies
+ENCODINGS = ('br', 'gzip') if USE_BROTLI else ('gzip',)
+ENCODE_MIN_BYTES = 256  # Smaller bodies are always sent as they are
+ENCODED_CACHE_SIZE = int(os.environ.get('ENCODED_CACHE_SIZE', '1024'))
+PRECOMPRESSED = (('full', 2), ('simple', 2), ('forecast', 7))
+
+# Long-term archive of every distinct snapshot (/schedule/history), one subdirectory
+# per region; set ARCHIVE_DIR='' to disable.
+# Keep it on persistent storage: unlike the snapshot store it should survive reboots.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '365'))
+ARCHIVE_MAX_MB = int(os.environ.get('ARCHIVE_MAX_MB', '64'))  # Per region
+ARCHIVE_COMPACT_AFTER_DAYS = int(os.environ.get('ARCHIVE_COMPACT_AFTER_DAYS', '31'))
+
+# Serving and refresh metrics, next to the scraper's on the same registry (/metrics)
+metrics.histogram('dtek_refresh_seconds', 'Duration of region refreshes by result', SCRAPE_BUCKETS)
+metrics.counter('dtek_scrapes_total', 'Refresh attempts by region')
+metrics.histogram('dtek_freshness_lag_seconds', "Delay from DTEK's update time to noticing the update",
+                  (30, 60, 120, 180, 300, 600, 900, 1800, 3600))
+metrics.counter('dtek_cache_requests_total',
+                'get_cached_data() calls by result: hit, stale (expired data served), '
+                'miss (waited for the first snapshot) or failure (no data)')
+metrics.histogram('dtek_http_request_seconds', 'Request latency by endpoint',
+                  (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10, 60))
+metrics.histogram('dtek_http_response_bytes', 'Response body size by endpoint',
+                  (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576))
+
+
+def new_cache(region, url):
+    """
+    Cache for one region's schedule data (to avoid hammering the DTEK website).
+    Kept fresh by the background refresher; requests only ever read from it.
+    """
+    archive = None
+    if ARCHIVE_DIR:
+        archive = SnapshotArchive(
+            os.path.join(ARCHIVE_DIR, region),
+            retention_days=ARCHIVE_RETENTION_DAYS,
+            max_bytes=ARCHIVE_MAX_MB * 1024 * 1024,
+            compact_after_days=ARCHIVE_COMPACT_AFTER_DAYS
+        )
+    return {
+        'region': region,
+        'url': url,
+        'data': None,
+        'timestamp': 0,
+        'ttl': 300,  # Current refresh interval, set by the adaptive scheduler (refresh_interval)
+        'retry': 60,  # First retry after a failed refresh; doubles (with jitter) per failure
+        'retry_at': 0,  # When the next retry is due while refreshes are failing
+        'update_hours': list(UPDATE_HOURS_PRIOR),  # Decayed count of DTEK updates per local hour
+        'last_change': 0,  # DTEK `update` time of the newest update seen
+        'learned': False,  # Update history read from the archive (leader, once per process)
+        'scrapes': 0,  # Refresh attempts (shared through the snapshot, so it survives leader changes)
+        'freshness_lag': None,  # Seconds from DTEK's update time to our noticing it, last update
+        'stale_after': REFRESH_MAX_INTERVAL + 300,  # Data this old is reported as stale (refreshes failing)
+        'miss_wait': 10,  # Max seconds a request waits for the very first fetch
+        'generation': 0,  # Bumped on every successful refresh
+        'responses': None,  # Responses precompiled for the current generation
+        'changes': [],  # Change feed: recent per-queue schedule diffs, oldest first
+        'change_seq': 0,  # Sequence number of the newest change record
+        'queue_digests': {},  # Digest of each queue's data in the current snapshot
+        'queue_updates': {},  # Per-queue change stamps (see stamp_queues), shared through the snapshot
+        'max_changes': 200,  # Change records kept in the feed
+        'last_attempt': 0,
+        'last_error': None,
+        'failures': 0,
+        'snapshot_file': os.path.join(SNAPSHOT_DIR, f'snapshot.{region}.json'),
+        'store_stamp': None,  # (inode, mtime, size) of the last loaded snapshot file
+        'encoded': OrderedDict(),  # LRU of compressed bodies not precompressed: (etag, encoding) -> body
+        'encoded_lock': threading.Lock(),
+        'archive': archive
+    }
+
+
+# Per-region caches, each with its own TTL, failure state and snapshot
+caches = {region: new_cache(region, url) for region, url in REGIONS.items()}
+
+# Background refresher state
+refresher = {
+    'thread': None,
+    'lock': threading.Lock(),
+    'leader': False,  # True in the one process that scrapes
+    'leader_fd': None,  # Held open (and locked) for the lifetime of the leader
+    'can_lead': not SCRAPER_DAEMON,  # False in API workers when scraper_daemon.py scrapes
+    'store_poll': 1,  # Seconds between snapshot file checks in reader workers
+    'pool': ThreadPoolExecutor(max_workers=len(REGIONS), thread_name_prefix='region-refresh')
 }
 
 
@@ -50,339 +177,1359 @@ def require_password(f):
     return decorated_function
 
 
-def find_chromedriver():
-    """Find ChromeDriver executable in common locations or PATH."""
-    # Check PATH first (most universal)
-    chromedriver_path = shutil.which('chromedriver')
-    if chromedriver_path:
-        return chromedriver_path
+def unknown_region(region):
+    """Body of the error for a region= that is not configured."""
+    return {
+        'error': 'Unknown region',
+        'message': f"Region {region!r} is not served here, available: {', '.join(REGIONS)}"
+    }
+
+
+def with_region(f):
+    """Decorator resolving the region parameter; passes that region's cache as `cache`."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        region = request.args.get('region', DEFAULT_REGION)
+        if region not in caches:
+            return jsonify(unknown_region(region)), 404
+        return f(*args, cache=caches[region], **kwargs)
+    return decorated_function
+
+
+def not_available(cache):
+    """503 for a region with no data yet, telling the client when to retry."""
+    response = jsonify({'error': 'Data not available yet'})
+    response.headers['Retry-After'] = str(cache['retry'])
+    return response, 503
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls: at most one call per key runs at a time and
+    every caller waiting on that key gets its result.
     
-    # Common system locations
-    common_paths = [
-        '/usr/bin/chromedriver',
-        '/usr/local/bin/chromedriver',
-        '/snap/bin/chromium.chromedriver',
-    ]
+    The call runs in its own thread so waiters can give up after a deadline
+    without abandoning the work. Uses only threading primitives, so it also
+    works with gevent workers (threading is monkey-patched to greenlets).
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
     
-    for path in common_paths:
-        if os.path.exists(path) and os.access(path, os.X_OK):
-            return path
+    def in_flight(self, key):
+        """True if a call for key is currently running."""
+        with self._lock:
+            return key in self._calls
     
-    # Return None to let undetected-chromedriver auto-download (may fail on ARM)
-    return None
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn for key, or join the call already running for it.
+        Returns fn's result, or None if it did not finish within timeout seconds.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {'done': threading.Event(), 'result': None}
+                self._calls[key] = call
+                threading.Thread(target=self._run, args=(key, call, fn),
+                                 name='single-flight', daemon=True).start()
+        if not call['done'].wait(timeout):
+            return None
+        return call['result']
+    
+    def _run(self, key, call, fn):
+        try:
+            call['result'] = fn()
+        except Exception as e:
+            print(f"Error in single-flight call {key!r}: {e}")
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
 
+# One scrape per (region, cache generation), shared by the refresher and request threads
+refresh_flight = SingleFlight()
 
-def find_chromium_binary():
-    """Find Chromium binary in common locations or PATH."""
-    # Check PATH first
-    chromium_path = shutil.which('chromium-browser') or shutil.which('chromium')
-    if chromium_path:
-        return chromium_path
+
+def try_become_leader():
+    """
+    Try to become the refresher for this host by taking an exclusive lock on
+    LOCK_FILE. The lock is released by the OS when the process dies, so a
+    reader takes over on its next attempt.
+    """
+    if refresher['leader']:
+        return True
+    if not refresher['can_lead']:
+        return False
     
-    # Common system locations
-    common_paths = [
-        '/usr/bin/chromium-browser',
-        '/usr/bin/chromium',
-        '/snap/bin/chromium',
-    ]
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        print(f"Warning: Snapshot store unavailable ({e}), refreshing in this process only")
+        refresher['leader'] = True
+        return True
     
-    for path in common_paths:
-        if os.path.exists(path) and os.access(path, os.X_OK):
-            return path
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
     
-    return None
+    refresher['leader_fd'] = fd
+    refresher['leader'] = True
+    print(f"Process {os.getpid()} elected as schedule refresher")
+    return True
 
 
-def setup_driver():
-    """Setup Chrome driver with options to avoid detection."""
-    if USE_UNDETECTED:
-        options = uc.ChromeOptions()
-        options.add_argument('--headless')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        
-        # Find Chromium binary and ChromeDriver
-        chromium_binary = find_chromium_binary()
-        chromedriver_path = find_chromedriver()
-        
-        # Set Chromium binary location if found
-        if chromium_binary:
-            options.binary_location = chromium_binary
-        
-        # Use system ChromeDriver if found
-        if chromedriver_path:
-            driver = uc.Chrome(options=options, driver_executable_path=chromedriver_path, version_main=None)
-        else:
-            # Fallback: let it auto-download (may fail on ARM)
-            driver = uc.Chrome(options=options, version_main=None)
-        return driver
-    else:
-        chrome_options = Options()
-        chrome_options.add_argument('--headless')
-        chrome_options.add_argument('--no-sandbox')
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-        chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        chrome_options.add_experimental_option('useAutomationExtension', False)
-        chrome_options.add_argument('user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36')
-        
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {
-            'source': 'Object.defineProperty(navigator, "webdriver", {get: () => undefined})'
-        })
-        return driver
+def _snapshot_stamp(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 
-def extract_json_from_browser(driver):
-    """Extract preset and fact JSON directly from browser JavaScript context."""
-    preset_json = None
-    fact_json = None
-    
+def save_snapshot(cache):
+    """Atomically publish a region's cache to its shared snapshot file."""
+    snapshot = {key: cache[key] for key in SNAPSHOT_KEYS}
+    tmp_file = f"{cache['snapshot_file']}.{os.getpid()}.tmp"
     try:
-        preset_json_str = driver.execute_script("""
-            if (typeof DisconSchedule !== 'undefined' && DisconSchedule.preset) {
-                return JSON.stringify(DisconSchedule.preset);
-            }
-            return null;
-        """)
-        if preset_json_str:
-            preset_json = json.loads(preset_json_str)
-    except Exception as e:
-        print(f"Warning: Could not extract preset JSON: {e}")
-    
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_file, cache['snapshot_file'])
+        cache['store_stamp'] = _snapshot_stamp(cache['snapshot_file'])
+    except OSError as e:
+        print(f"Warning: Could not save snapshot: {e}")
+
+
+def load_snapshot(cache):
+    """
+    Load a region's shared snapshot file into its cache if it changed since
+    the last load. Costs one stat() when unchanged. Returns True if new data
+    was loaded.
+    """
     try:
-        fact_json_str = driver.execute_script("""
-            if (typeof DisconSchedule !== 'undefined' && DisconSchedule.fact) {
-                return JSON.stringify(DisconSchedule.fact);
-            }
-            return null;
-        """)
-        if fact_json_str:
-            fact_json = json.loads(fact_json_str)
-    except Exception as e:
-        print(f"Warning: Could not extract fact JSON: {e}")
+        stamp = _snapshot_stamp(cache['snapshot_file'])
+        if stamp == cache['store_stamp']:
+            return False
+        with open(cache['snapshot_file'], encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not load snapshot: {e}")
+        return False
     
-    return preset_json, fact_json
+    cache['store_stamp'] = stamp
+    for key in SNAPSHOT_KEYS:
+        if key in snapshot:
+            cache[key] = snapshot[key]
+    compile_responses(cache)
+    return True
+
+
+def wait_for_snapshot(cache, timeout):
+    """Reader workers: wait up to timeout seconds for the leader's first snapshot."""
+    deadline = time.time() + timeout
+    while not load_snapshot(cache) and cache['data'] is None and time.time() < deadline:
+        time.sleep(0.5)
+
+
+def diff_schedules(old_fact, new_fact):
+    """
+    Per (queue, date, hour) differences between two fact snapshots, as
+    {queue: {date timestamp: {hour (0-23): new status}}}. Dates that dropped
+    out of the new snapshot (days gone by) are not reported.
+    """
+    old_data = old_fact.get('data', {})
+    changes = {}
+    for day, queues in new_fact.get('data', {}).items():
+        old_queues = old_data.get(day, {})
+        for queue, hours in queues.items():
+            old_hours = old_queues.get(queue) or {}
+            for hour in range(24):
+                hour_str = str(hour + 1)
+                status = hours.get(hour_str)
+                if status != old_hours.get(hour_str):
+                    changes.setdefault(queue, {}).setdefault(day, {})[hour] = status
+    return changes
+
+
+def record_changes(cache, changes, fact_json):
+    """Append a diff to the change feed, dropping the oldest records."""
+    cache['change_seq'] += 1
+    cache['changes'] = cache['changes'][-(cache['max_changes'] - 1):] + [{
+        'seq': cache['change_seq'],
+        'time': int(time.time()),
+        'update': fact_json.get('update'),
+        'changes': changes
+    }]
+    print(f"[{cache['region']}] Schedule changed for {len(changes)} queue(s): {', '.join(sorted(changes))}")
 
 
-def fetch_schedule_data():
-    """Fetch schedule data from DTEK website."""
-    url = "https://www.dtek-dnem.com.ua/ua/shutdowns"
+def archive_snapshot(cache):
+    """Append a region's cached snapshot to its history archive (skipped if unchanged)."""
+    if cache['archive'] is None:
+        return
+    try:
+        cache['archive'].append(cache['timestamp'], cache['data'])
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not archive snapshot: {e}")
+
+
+def smoothed_update_hours(cache):
+    """Update-hour profile with each hour sharing half its weight with its neighbours."""
+    hours = cache['update_hours']
+    return [hours[hour] + (hours[hour - 1] + hours[(hour + 1) % 24]) / 2 + 1e-3 for hour in range(24)]
+
+
+def refresh_interval(cache, now=None):
+    """
+    Seconds between refreshes of a region right now: shorter in the hours DTEK
+    usually publishes and for a while after each update (corrections tend to
+    follow), longer once the schedule has been stable for a day or more.
+    """
+    now = now or time.time()
+    weights = smoothed_update_hours(cache)
+    # Spend REFRESH_DAILY_BUDGET scrapes per day with intervals ~ 1/sqrt(update rate)
+    scale = 3600 * sum(math.sqrt(weight) for weight in weights) / REFRESH_DAILY_BUDGET
+    weight = weights[time.localtime(now).tm_hour]
     
-    driver = None
+    since_change = now - cache['last_change']
+    weight += 3 * max(weights) * math.exp(-since_change / 1800)
+    interval = scale / math.sqrt(weight)
+    if since_change > 3 * 86400:
+        interval *= 4
+    elif since_change > 86400:
+        interval *= 2
+    return min(REFRESH_MAX_INTERVAL, max(REFRESH_MIN_INTERVAL, interval))
+
+
+def expected_updates(cache, start, hours=UPDATE_HORIZON_HOURS):
+    """
+    Starts of the hours after `start` in which DTEK usually publishes (more
+    than an average share of the update-hour profile), sorted.
+    """
+    weights = smoothed_update_hours(cache)
+    mean = sum(weights) / 24
+    first = int(start) // 3600 * 3600 + 3600
+    return [hour for hour in range(first, first + hours * 3600, 3600)
+            if weights[time.localtime(hour).tm_hour] > mean]
+
+
+def retry_delay(cache):
+    """Exponential backoff with jitter after the n-th failed refresh in a row."""
+    ceiling = min(RETRY_MAX_INTERVAL, cache['retry'] * 2 ** (cache['failures'] - 1))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def learn_update(cache, fact_json):
+    """
+    Add a newly seen DTEK `update` stamp to the region's update-hour profile.
+    Returns its time, or None if it is not newer than the last one seen.
+    """
+    updated = parse_update_time(fact_json, 0)
+    if not updated or updated <= cache['last_change']:
+        return None
+    hours = [weight * UPDATE_DECAY for weight in cache['update_hours']]
+    hours[time.localtime(updated).tm_hour] += 1
+    cache['update_hours'] = hours
+    cache['last_change'] = updated
+    return updated
+
+
+def learn_from_archive(cache, days=30):
+    """Seed the update-hour profile from the archived snapshots of the last days."""
+    cache['learned'] = True
+    if cache['archive'] is None:
+        return
+    learned = 0
     try:
-        driver = setup_driver()
-        driver.get(url)
-        
-        # Wait for JavaScript to execute
-        max_wait = 30
-        waited = 0
-        while waited < max_wait:
-            try:
-                result = driver.execute_script("""
-                    return typeof DisconSchedule !== 'undefined' && 
-                           DisconSchedule.fact && 
-                           DisconSchedule.preset;
-                """)
-                if result:
-                    break
-            except:
-                pass
-            time.sleep(2)
-            waited += 2
-        
-        preset_json, fact_json = extract_json_from_browser(driver)
-        
-        if not preset_json or not fact_json:
-            return None
+        for _, document in cache['archive'].iter_snapshots(time.time() - days * 86400, time.time()):
+            if learn_update(cache, document.get('fact', {})):
+                learned += 1
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read the archive: {e}")
+    if learned:
+        print(f"[{cache['region']}] Learned {learned} update time(s) from the archive")
+
+
+def refresh_cache(cache):
+    """Fetch fresh data for a region, store it in its cache and publish it. Returns True on success."""
+    cache['last_attempt'] = time.time()
+    cache['scrapes'] += 1
+    metrics.inc('dtek_scrapes_total', region=cache['region'])
+    started = time.perf_counter()
+    data = fetch_schedule_data(cache['url'])
+    if not data:
+        cache['failures'] += 1
+        cache['last_error'] = 'Could not retrieve data from DTEK website'
+        cache['retry_at'] = cache['last_attempt'] + retry_delay(cache)
+        print(f"[{cache['region']}] Refresh failed ({cache['failures']} in a row), keeping previous data, "
+              f"retrying in {cache['retry_at'] - cache['last_attempt']:.0f}s")
+        save_snapshot(cache)
+        metrics.observe('dtek_refresh_seconds', time.perf_counter() - started,
+                        region=cache['region'], result='failed')
+        return False
+    
+    if cache['data']:
+        changes = diff_schedules(cache['data']['fact'], data['fact'])
+        if changes:
+            record_changes(cache, changes, data['fact'])
+    
+    updated = learn_update(cache, data['fact'])
+    if updated and cache['data']:
+        # Only updates published while we were watching say anything about our lag
+        cache['freshness_lag'] = max(0, int(time.time() - updated))
+        metrics.observe('dtek_freshness_lag_seconds', cache['freshness_lag'], region=cache['region'])
+    
+    cache['data'] = data
+    cache['timestamp'] = time.time()
+    cache['generation'] += 1
+    cache['failures'] = 0
+    cache['last_error'] = None
+    cache['ttl'] = refresh_interval(cache)
+    stamp_queues(cache)
+    compile_responses(cache)
+    save_snapshot(cache)
+    archive_snapshot(cache)
+    print(f"[{cache['region']}] Cache refreshed")
+    metrics.observe('dtek_refresh_seconds', time.perf_counter() - started, region=cache['region'], result='ok')
+    return True
+
+
+def refresh_once(cache, timeout=None):
+    """Refresh a region's cache, joining a refresh already running for this generation."""
+    return refresh_flight.do((cache['region'], cache['generation']), lambda: refresh_cache(cache), timeout)
+
+
+def next_refresh(cache):
+    """When the refresher should next scrape a region."""
+    if cache['data'] is None or cache['failures']:
+        return cache['retry_at']
+    return cache['timestamp'] + cache['ttl']
+
+
+def refresh_regions(region_caches):
+    """
+    Refresh several regions concurrently, so the wall time is that of the
+    slowest one. Browser scrapes are bounded by the browser pool size.
+    """
+    return list(refresher['pool'].map(refresh_once, region_caches))
+
+
+def refresher_loop():
+    """
+    Keep every region's cache fresh. The elected leader refreshes each region
+    when its adaptive interval is up (see refresh_interval; failures back off
+    exponentially), all regions that are due at once; every other worker
+    follows the snapshot files.
+    """
+    while True:
+        for cache in caches.values():
+            load_snapshot(cache)
+        if not try_become_leader():
+            time.sleep(refresher['store_poll'])
+            continue
         
-        return {
-            'preset': preset_json,
-            'fact': fact_json
-        }
+        for cache in caches.values():
+            if not cache['learned']:
+                learn_from_archive(cache)
+            if cache['data'] is not None:
+                # Follow the time of day (and a previous leader's snapshot)
+                cache['ttl'] = refresh_interval(cache)
         
-    except Exception as e:
-        print(f"Error fetching schedule: {e}")
-        return None
-    finally:
-        if driver:
-            driver.quit()
+        # Snapshots left by a previous leader are not due until their ttl is up
+        due = [cache for cache in caches.values() if next_refresh(cache) <= time.time()]
+        if due:
+            refresh_regions(due)
+        wake = min(next_refresh(cache) for cache in caches.values())
+        # Wake at least every minute, so intervals shorten as soon as a busy hour starts
+        time.sleep(min(60, max(1, wake - time.time())))
+
+
+def start_refresher():
+    """Start the background refresher thread once per process."""
+    with refresher['lock']:
+        thread = refresher['thread']
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=refresher_loop, name='schedule-refresher', daemon=True)
+        thread.start()
+        refresher['thread'] = thread
 
 
-def get_cached_data():
-    """Get cached data or fetch new data if cache expired."""
+def get_cached_data(cache):
+    """
+    Get a region's last good data from memory.
+    
+    An expired cache is served as is while a single coalesced refresh runs.
+    Only an empty cache makes the request wait, and never longer than miss_wait.
+    Reader workers never scrape; they wait for the leader's snapshot instead.
+    """
+    start_refresher()
     current_time = time.time()
+    missed = cache['data'] is None
+    
+    if not refresher['leader']:
+        if missed:
+            wait_for_snapshot(cache, cache['miss_wait'])
+        return count_cache_read(cache, missed)
+    
+    expired = missed or (current_time - cache['timestamp']) > cache['ttl']
+    if expired and (refresh_flight.in_flight((cache['region'], cache['generation'])) or
+                    current_time >= next_refresh(cache)):
+        refresh_once(cache, timeout=cache['miss_wait'] if missed else 0)
+    
+    return count_cache_read(cache, missed)
+
+
+def count_cache_read(cache, missed):
+    """Count a get_cached_data() result by outcome and return the data."""
+    data = cache['data']
+    if data is None:
+        result = 'failure'
+    elif missed:
+        result = 'miss'
+    elif time.time() - cache['timestamp'] > cache['ttl']:
+        result = 'stale'
+    else:
+        result = 'hit'
+    metrics.inc('dtek_cache_requests_total', region=cache['region'], result=result)
+    return data
+
+
+def get_data_age(cache):
+    """Seconds since a region's cached data was fetched, or None if there is none."""
+    if cache['data'] is None:
+        return None
+    return int(time.time() - cache['timestamp'])
+
+
+def is_data_stale(cache):
+    """True when a region's cached data is older than the staleness threshold."""
+    age = get_data_age(cache)
+    return age is None or age > cache['stale_after']
+
+
+def freshness_headers(cache):
+    """Headers telling the age of the data a response was built from."""
+    age = get_data_age(cache)
+    if age is None:
+        return {}
+    return {
+        'X-Data-Age': str(age),
+        'X-Data-Stale': '1' if is_data_stale(cache) else '0'
+    }
+
+
+def with_freshness(response, cache):
+    """Mark a response with the age of the data it was built from."""
+    response.headers.update(freshness_headers(cache))
+    return response
+
+
+def serialize(result):
+    """Serialize exactly like jsonify() does, but to bytes we can keep."""
+    return f"{app.json.dumps(result, separators=(',', ':'))}\n".encode('utf-8')
+
+
+def compile_response(endpoint, fact_json, queue, days, weekly=None):
+    """
+    Build and serialize one response. Returns (status, body, etag).
     
-    if cache['data'] is None or (current_time - cache['timestamp']) > cache['ttl']:
-        print("Cache expired or empty, fetching new data...")
-        data = fetch_schedule_data()
-        if data:
-            cache['data'] = data
-            cache['timestamp'] = current_time
-        return data
+    The strong ETag is derived from DTEK's update stamp plus the request key,
+    and also covers the body so it changes even if DTEK edits data in place.
+    """
+    if endpoint == 'packed':
+        body, status = encode_packed(fact_json, queue, days), 200
+    elif endpoint == 'forecast':
+        result, status = build_forecast(fact_json, weekly or {}, queue, days)
+        body = serialize(result)
+    elif endpoint == 'full':
+        result, status = build_schedule(fact_json, queue, days)
+        body = serialize(result)
+    else:
+        result, status = build_schedule_simple(fact_json, queue, days)
+        body = serialize(result)
     
-    print("Returning cached data")
-    return cache['data']
+    etag = None
+    if status == 200:
+        key = f"{endpoint}:{queue}:{days}:{fact_json.get('update', '')}:".encode('utf-8')
+        etag = hashlib.sha1(key + body).hexdigest()[:20]
+    return status, body, etag
 
 
-def parse_schedule_for_queue(fact_json, queue, timestamp):
-    """Parse schedule for a specific queue and timestamp."""
-    timestamp_str = str(timestamp)
+def stamp_queues(cache):
+    """
+    Per-queue change stamps of a region's snapshot: the DTEK update stamp of
+    the snapshot in which each queue's data last changed (unchanged queues
+    keep their old stamp). Data DTEK edited without bumping `update` gets the
+    stamp plus "#" and a short digest of the new data, so it still reads as a
+    change. Set by the leader before publishing, so readers that never saw
+    the earlier snapshots take the same stamps from the file.
+    """
+    fact_json = cache['data']['fact']
+    update = str(fact_json.get('update') or cache['generation'])
+    queues = sorted({queue for day in fact_json.get('data', {}).values() for queue in day})
+    queue_digests = {}
+    queue_updates = {}
+    for queue in queues:
+        queue_data = {day: fact_json['data'][day].get(queue) for day in sorted(fact_json['data'])}
+        digest = hashlib.sha1(json.dumps(queue_data, sort_keys=True).encode('utf-8')).hexdigest()
+        queue_digests[queue] = digest
+        previous = cache['queue_updates'].get(queue)
+        if cache['queue_digests'].get(queue) == digest and previous is not None:
+            queue_updates[queue] = previous
+        elif previous is not None and previous.split('#')[0] == update:
+            queue_updates[queue] = f"{update}#{digest[:8]}"
+        else:
+            queue_updates[queue] = update
+    cache['queue_digests'] = queue_digests
+    cache['queue_updates'] = queue_updates
+
+
+def compile_responses(cache):
+    """
+    Precompile every /schedule, /schedule/simple, /schedule/packed and
+    /schedule/forecast response for a region's cached snapshot, keyed by
+    (endpoint, queue, days). Runs once per new snapshot so a request is a dict
+    lookup on ready-to-send bytes.
+    
+    Only queues whose data changed are recompiled when the day window is the
+    same as before; /schedule and /schedule/forecast bodies embed the update
+    stamp, so they are only reused when that did not change either. Forecasts
+    are also recompiled when the weekly plan (preset) changed.
+    """
+    data = cache['data']
+    compiled = cache.get('responses')
+    if not data or (compiled and compiled['generation'] == cache['generation']):
+        return
     
-    if timestamp_str not in fact_json.get('data', {}):
+    fact_json = data['fact']
+    today_timestamp = get_today_timestamp(fact_json)
+    last_modified = parse_update_time(fact_json, cache['timestamp'])
+    day_keys = [int(key) for key in fact_json.get('data', {}) if key.isdigit()]
+    queues = sorted({queue for day in fact_json.get('data', {}).values() for queue in day})
+    
+    # Asking for more days than there is data for gives the same response
+    max_days = max([(key - today_timestamp) // 86400 + 1 for key in day_keys] + [0])
+    
+    # Per-queue change stamps come with the snapshot, so every worker reports the
+    # leader's; only a snapshot saved without them is stamped here
+    if set(cache['queue_digests']) != set(queues):
+        stamp_queues(cache)
+    queue_digests = cache['queue_digests']
+    queue_updates = cache['queue_updates']
+    previous = compiled or {'queue_digests': {}}
+    
+    reusable = {}
+    if compiled and compiled['today'] == today_timestamp and compiled['max_days'] == max_days:
+        reusable = compiled['table']
+    same_update = compiled is not None and compiled['fact'].get('update') == fact_json.get('update')
+    
+    # The weekly plan, compiled once so a week of forecast costs the same as a day
+    weekly = compile_weekly(data.get('preset'))
+    weekly_digest = hashlib.sha1(json.dumps(weekly, sort_keys=True).encode('utf-8')).hexdigest()
+    same_plan = (compiled is not None and compiled['today'] == today_timestamp and
+                 compiled['weekly_digest'] == weekly_digest and same_update)
+    
+    table = {}
+    recompiled = 0
+    for queue in queues:
+        unchanged = previous['queue_digests'].get(queue) == queue_digests[queue]
+        if not unchanged:
+            recompiled += 1
+        for days in range(max_days + 1):
+            for endpoint in ('full', 'simple', 'packed'):
+                key = (endpoint, queue, days)
+                if unchanged and key in reusable and (endpoint != 'full' or same_update):
+                    table[key] = reusable[key]
+                else:
+                    table[key] = compile_response(endpoint, fact_json, queue, days)
+    for queue in sorted(set(queues) | set(weekly)):
+        unchanged = previous['queue_digests'].get(queue) == queue_digests.get(queue)
+        for days in range(FORECAST_MAX_DAYS + 1):
+            key = ('forecast', queue, days)
+            if unchanged and same_plan and key in compiled['table']:
+                table[key] = compiled['table'][key]
+            else:
+                table[key] = compile_response('forecast', fact_json, queue, days, weekly)
+    if compiled:
+        print(f"Recompiled {recompiled} of {len(queues)} queues")
+    
+    # Compressed variants of each queue's default requests, carried over while unchanged
+    previous_encoded = compiled['encoded'] if compiled else {}
+    encoded = {}
+    for queue in queues:
+        for endpoint, days in PRECOMPRESSED:
+            days = min(days, FORECAST_MAX_DAYS if endpoint == 'forecast' else max_days)
+            status, body, etag = table.get((endpoint, queue, days), (None, None, None))
+            if status == 200:
+                encoded[etag] = previous_encoded.get(etag) or {
+                    encoding: encode_body(body, encoding) for encoding in ENCODINGS
+                }
+    
+    matrix = compile_fact_matrix(fact_json)
+    cache['responses'] = {
+        'generation': cache['generation'],
+        'today': today_timestamp,
+        'fact': fact_json,
+        'last_modified': last_modified,
+        'last_modified_header': http_date(last_modified),
+        'max_days': max_days,
+        'weekly': weekly,
+        'weekly_digest': weekly_digest,
+        'queue_digests': queue_digests,
+        'queue_updates': queue_updates,
+        'queues': queues,
+        'table': table,
+        'encoded': encoded,
+        'matrix': matrix,
+        'stats': {},
+        'transitions': compile_transitions(matrix),
+        'updates': expected_updates(cache, cache['timestamp'])
+    }
+    with snapshot_changed:
+        snapshot_changed.notify_all()
+    for listener in snapshot_listeners:
+        listener()
+
+
+def encode_body(body, encoding):
+    """A body compressed with `encoding`, or None if that would not make it smaller."""
+    if len(body) < ENCODE_MIN_BYTES:
         return None
+    if encoding == 'br':
+        encoded = brotli.compress(body, quality=11)
+    else:
+        encoded = gzip.compress(body, compresslevel=9, mtime=0)
+    return encoded if len(encoded) < len(body) else None
+
+
+def choose_encoding(accept_encodings):
+    """The preferred one of ENCODINGS in a parsed Accept-Encoding header, None for identity."""
+    if not accept_encodings:
+        return None
+    best = max(ENCODINGS, key=accept_encodings.quality)  # The first on ties
+    return best if accept_encodings.quality(best) > 0 else None
+
+
+def encoded_entry_body(cache, compiled, entry, encoding):
+    """
+    A compiled entry's body compressed with `encoding` (None: send it as it
+    is). Precompressed variants are a lookup; any other entry is compressed
+    on first use and kept in the region's LRU, keyed by its ETag so it
+    outlives snapshots in which it did not change.
+    """
+    _, body, etag = entry
+    variants = compiled['encoded'].get(etag)
+    if variants is not None:
+        return variants[encoding]
     
-    queue_data = fact_json['data'][timestamp_str].get(queue, {})
-    if not queue_data:
+    key = (etag, encoding)
+    lru = cache['encoded']
+    with cache['encoded_lock']:
+        if key in lru:
+            lru.move_to_end(key)
+            return lru[key]
+    encoded = encode_body(body, encoding)
+    with cache['encoded_lock']:
+        lru[key] = encoded
+        while len(lru) > ENCODED_CACHE_SIZE:
+            lru.popitem(last=False)
+    return encoded
+
+
+def is_not_modified(etag, last_modified, if_none_match, if_modified_since):
+    """
+    Evaluate parsed conditional request headers against a compiled response
+    (any of its encodings: their ETags are the identity one plus a suffix).
+    """
+    if if_none_match:
+        return any(if_none_match.contains_weak(tag)
+                   for tag in [etag] + [f'{etag}-{encoding}' for encoding in ENCODINGS])
+    if if_modified_since:
+        return if_modified_since.timestamp() >= last_modified
+    return False
+
+
+def get_compiled(cache):
+    """Responses compiled for a region's cached snapshot, or None if there is no data yet."""
+    if not get_cached_data(cache):
         return None
+    compiled = cache.get('responses')
+    if not compiled:
+        compile_responses(cache)
+        compiled = cache['responses']
+    return compiled
+
+
+def lookup_response(compiled, endpoint, queue, days):
+    """Precompiled (status, body, etag) for a request key."""
+    max_days = FORECAST_MAX_DAYS if endpoint == 'forecast' else compiled['max_days']
+    days = min(max(days, 0), max_days)
+    entry = compiled['table'].get((endpoint, queue, days))
+    if entry is None:
+        # Unknown queue: cheap to build, not worth keeping
+        entry = compile_response(endpoint, compiled['fact'], queue, days, compiled['weekly'])
+    return entry
+
+
+def next_wake(compiled, queue, now):
+    """
+    Where `now` falls in a queue's transition index: (power now, next change as
+    (time, power) or None, next expected DTEK update or None, seconds to sleep).
+    Two bisections, whatever the number of queues and days.
+    """
+    times, powers = compiled['transitions'].get(queue, ((), ()))
+    i = bisect.bisect_right(times, now)
+    power = powers[i - 1] if i else None
+    change = (times[i], powers[i]) if i < len(times) else None
+    updates = compiled['updates']
+    j = bisect.bisect_right(updates, now)
+    update = updates[j] if j < len(updates) else None
     
-    schedule = []
-    for hour in range(24):
-        hour_str = str(hour + 1)
-        status = queue_data.get(hour_str, 'unknown')
-        schedule.append({
-            'hour': hour,
-            'status': status
-        })
+    wake = min(t for t in (change and change[0], update, now + SLEEP_HINT_MAX) if t)
+    return power, change, update, max(SLEEP_HINT_MIN, math.ceil(wake - now))
+
+
+def next_response(compiled, queue, now=None):
+    """Body of /schedule/next."""
+    now = now or time.time()
+    power, change, update, sleep = next_wake(compiled, queue, now)
+    return {
+        'queue': queue,
+        'time': int(now),
+        'power': power,
+        'next_change': change and {'time': change[0], 'power': change[1]},
+        'next_update': update,
+        'sleep': sleep,
+        'update_time': compiled['fact'].get('update')
+    }
+
+
+def render_entry(cache, compiled, entry, mimetype, if_none_match, if_modified_since, accept_encodings=None):
+    """
+    Framework-independent rendering of a compiled entry: (status, headers, body).
+    Matching conditional requests get a bodiless 304. With the parsed
+    Accept-Encoding header, the body is sent in the best encoding both sides
+    support, from the precompressed variants.
+    """
+    status, body, etag = entry
+    headers = freshness_headers(cache)
+    if etag is None:
+        headers['Content-Type'] = mimetype
+        return status, headers, body
     
-    return schedule
+    tag = etag
+    encoding = choose_encoding(accept_encodings)
+    if accept_encodings is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if is_not_modified(etag, compiled['last_modified'], if_none_match, if_modified_since):
+        status, body = 304, b''
+        if encoding and if_none_match and if_none_match.contains_weak(f'{etag}-{encoding}'):
+            tag = f'{etag}-{encoding}'
+    else:
+        headers['Content-Type'] = mimetype
+        encoded = encoding and encoded_entry_body(cache, compiled, entry, encoding)
+        if encoded:
+            body = encoded
+            tag = f'{etag}-{encoding}'
+            headers['Content-Encoding'] = encoding
+    # Cacheable until the next scheduled refresh
+    max_age = max(0, int(cache['ttl'] - (time.time() - cache['timestamp'])))
+    headers['ETag'] = f'"{tag}"'
+    headers['Last-Modified'] = compiled['last_modified_header']
+    headers['Cache-Control'] = f'public, max-age={max_age}'
+    return status, headers, body
 
 
-@app.route('/')
-def index():
-    """Simple info page."""
-    return jsonify({
+def entry_response(cache, compiled, entry, mimetype='application/json'):
+    """Turn a compiled entry into a Flask response."""
+    status, headers, body = render_entry(cache, compiled, entry, mimetype,
+                                         request.if_none_match, request.if_modified_since,
+                                         request.accept_encodings)
+    return app.response_class(body, status=status, headers=headers)
+
+
+def schedule_response(cache, endpoint, queue, days):
+    """Precompiled response for a request; None if there is no data yet."""
+    compiled = get_compiled(cache)
+    if compiled is None:
+        return None
+    return entry_response(cache, compiled, lookup_response(compiled, endpoint, queue, days))
+
+
+# format= of /schedule/batch and /schedule/all: the compiled endpoint each queue comes from
+BATCH_FORMATS = ('full', 'simple')
+BATCH_MAX_QUEUES = 255
+
+
+class BadParameter(ValueError):
+    """An invalid query parameter; answered with a 400 naming it in both Flask and ASGI mode."""
+
+
+def number_param(args, name, default, parse=int):
+    """A numeric query parameter (int, or float with parse=float). Raises BadParameter naming it."""
+    try:
+        value = parse(args.get(name, default))
+    except (TypeError, ValueError):
+        value = None
+    if value is None or not math.isfinite(value):
+        raise BadParameter(f"{name} must be {'an integer' if parse is int else 'a number'}")
+    return value
+
+
+def bad_request(error):
+    """Body of a 400 for an invalid query parameter (the same in Flask and ASGI mode)."""
+    return {'error': 'Bad request', 'message': str(error)}
+
+
+def queues_param(args):
+    """Queue names of a queues= parameter, duplicates dropped. Raises BadParameter."""
+    names = list(dict.fromkeys(name for name in args.get('queues', '').split(',') if name))
+    if len(names) > BATCH_MAX_QUEUES:
+        raise BadParameter(f"queues takes at most {BATCH_MAX_QUEUES} names")
+    return names
+
+
+def batch_params(args, default_format='full'):
+    """(endpoint, days) of a /schedule/batch or /schedule/all request. Raises BadParameter."""
+    endpoint = args.get('format', default_format)
+    if endpoint not in BATCH_FORMATS:
+        raise BadParameter(f"format must be one of {', '.join(BATCH_FORMATS)}")
+    return endpoint, number_param(args, 'days', '2')
+
+
+def batch_entries(compiled, endpoint, queues, days):
+    """
+    Precompiled entries of several queues, in the order asked for: ([(queue,
+    entry)], [queues with no data]). Never builds anything, so the cost is one
+    lookup per queue.
+    """
+    days = min(max(days, 0), compiled['max_days'])
+    table = compiled['table']
+    found = []
+    missing = []
+    for queue in queues:
+        entry = table.get((endpoint, queue, days))
+        if entry is None or entry[0] != 200:
+            missing.append(queue)
+        else:
+            found.append((queue, entry))
+    return found, missing
+
+
+def batch_etag(entries, missing=()):
+    """ETag of a multi-queue response, from the queues' own ETags."""
+    key = ''.join(f"{queue}:{entry[2]};" for queue, entry in entries) + ','.join(missing)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def encode_batch(entries, missing):
+    """{"queues": {queue: response}, "missing": [...]} spliced from the precompiled bodies."""
+    parts = [serialize(queue)[:-1] + b':' + entry[1][:-1] for queue, entry in entries]
+    return b'{"queues":{' + b','.join(parts) + b'},"missing":' + serialize(missing)[:-1] + b'}\n'
+
+
+def batch_response(compiled, args):
+    """(status, body, etag) entry of a /schedule/batch request. Raises BadParameter."""
+    endpoint, days = batch_params(args)
+    names = queues_param(args)
+    if not names:
+        raise BadParameter('queues is required')
+    entries, missing = batch_entries(compiled, endpoint, names, days)
+    return 200, encode_batch(entries, missing), batch_etag(entries, missing)
+
+
+def stats_response(compiled, args):
+    """
+    (status, body, etag) entry of a /schedule/stats request. Raises BadParameter.
+    Computed on first use per snapshot and hour, then kept with the snapshot.
+    """
+    hour = None
+    if args.get('hour') is not None:
+        hour = number_param(args, 'hour', None)
+        if not 0 <= hour < 24:
+            raise BadParameter('hour must be 0-23')
+    entry = compiled['stats'].get(hour)
+    if entry is None:
+        result = matrix_stats(compiled['matrix'], hour)
+        result['update_time'] = compiled['fact'].get('update')
+        body = serialize(result)
+        entry = (200, body, hashlib.sha1(body).hexdigest()[:20])
+        compiled['stats'][hour] = entry
+    return entry
+
+
+def service_info():
+    """Body of the info page."""
+    return {
         'service': 'DTEK Schedule API',
         'version': '1.0',
         'endpoints': {
             '/schedule': 'Get schedule data (requires ?password=xxx)',
-            '/health': 'Health check'
+            '/health': 'Health check',
+            '/metrics': 'Prometheus metrics'
         },
+        'regions': list(REGIONS),
         'usage': 'GET /schedule?password=YOUR_PASSWORD&queue=GPV3.1'
-    })
+    }
+
+
+def health_status():
+    """Body of the health check: the default region's state at the top, every region's below."""
+    start_refresher()
+    regions = {
+        region: {
+            'data_age': get_data_age(cache),
+            'stale': is_data_stale(cache),
+            'failures': cache['failures'],
+            'last_error': cache['last_error'],
+            'refresh_interval': int(cache['ttl']),
+            'next_refresh_in': max(0, int(next_refresh(cache) - time.time())),
+            'scrapes': cache['scrapes'],
+            'freshness_lag': cache['freshness_lag']
+        }
+        for region, cache in caches.items()
+    }
+    return {
+        'status': 'ok',
+        'role': 'refresher' if refresher['leader'] else 'reader',
+        **regions[DEFAULT_REGION],
+        'regions': regions
+    }
+
+
+def metrics_gauges():
+    """Per-region gauges for /metrics, as seen by this worker (all workers share the snapshots)."""
+    return [
+        ('dtek_snapshot_age_seconds', 'Seconds since the served snapshot was scraped',
+         [({'region': region}, time.time() - cache['timestamp'])
+          for region, cache in caches.items() if cache['data'] is not None]),
+        ('dtek_refresh_failures', 'Consecutive failed refreshes',
+         [({'region': region}, cache['failures']) for region, cache in caches.items()]),
+        ('dtek_refresh_interval_seconds', 'Current adaptive refresh interval',
+         [({'region': region}, cache['ttl']) for region, cache in caches.items()]),
+        ('dtek_ready_timeout_seconds', 'Current adaptive wait for DisconSchedule in browser scrapes',
+         [({}, ready_timeout())])
+    ]
+
+
+def observe_request(endpoint, seconds, size):
+    """Record a served request's latency and body size (None if streamed)."""
+    metrics.observe('dtek_http_request_seconds', seconds, endpoint=endpoint)
+    if size is not None:
+        metrics.observe('dtek_http_response_bytes', size, endpoint=endpoint)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.errorhandler(BadParameter)
+def invalid_parameter(e):
+    """Query parameters that fail to parse (see number_param) are the client's error."""
+    return jsonify(bad_request(e)), 400
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'other'
+        observe_request(endpoint, time.perf_counter() - started,
+                        None if response.is_streamed else response.calculate_content_length())
+    return response
+
+
+def queue_update(cache, queue):
+    """Change stamp of a queue's schedule in a region (see compile_responses), or None."""
+    compiled = cache.get('responses')
+    return compiled['queue_updates'].get(queue) if compiled else None
+
+
+@app.route('/')
+def index():
+    """Simple info page."""
+    return jsonify(service_info())
 
 
 @app.route('/health')
 def health():
     """Health check endpoint."""
-    return jsonify({'status': 'ok'})
+    return jsonify(health_status())
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics, summed over all workers on this host."""
+    start_refresher()
+    return Response(metrics.render(metrics_gauges()), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/schedule')
 @require_password
-def get_schedule():
+@with_region
+def get_schedule(cache):
     """
     Get schedule data for a specific queue.
     
     Query parameters:
     - password: API password (required)
+    - region: DTEK region (default: the first configured one)
     - queue: Queue name (default: GPV3.1)
     - days: Number of days to return (1 or 2, default: 2)
     """
     queue = request.args.get('queue', 'GPV3.1')
-    days = int(request.args.get('days', '2'))
+    days = number_param(request.args, 'days', '2')
     
-    # Get data from cache or fetch new
-    data = get_cached_data()
+    # Served from responses precompiled for the cached snapshot
+    response = schedule_response(cache, 'full', queue, days)
     
-    if not data:
-        return jsonify({
-            'error': 'Failed to fetch schedule data',
-            'message': 'Could not retrieve data from DTEK website'
-        }), 500
+    if response is None:
+        return not_available(cache)
     
-    fact_json = data['fact']
+    return response
+
+
+@app.route('/schedule/simple')
+@require_password
+@with_region
+def get_schedule_simple(cache):
+    """
+    Get simplified schedule data optimized for ESP32 (minimal payload).
     
-    # Get today's timestamp
-    today_timestamp = fact_json.get('today')
-    if not today_timestamp:
-        today = datetime.date.today()
-        today_timestamp = int(time.mktime(today.timetuple()))
+    Returns compact format: array of status codes for each hour.
+    Status codes: 0=no power, 1=power on, 2=first half off, 3=second half off
     
-    result = {
-        'queue': queue,
-        'update_time': fact_json.get('update', 'unknown'),
-        'days': []
-    }
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - queue: Queue name (default: GPV3.1)
+    - days: Number of days (1 or 2, default: 2)
+    """
+    queue = request.args.get('queue', 'GPV3.1')
+    days = number_param(request.args, 'days', '2')
     
-    # Get schedule for requested number of days
-    for day_offset in range(days):
-        day_timestamp = today_timestamp + (day_offset * 86400)
-        schedule = parse_schedule_for_queue(fact_json, queue, day_timestamp)
-        
-        if schedule:
-            day_date = datetime.datetime.fromtimestamp(day_timestamp)
-            result['days'].append({
-                'date': day_date.strftime('%Y-%m-%d'),
-                'day_name': day_date.strftime('%A'),
-                'timestamp': day_timestamp,
-                'schedule': schedule
-            })
+    response = schedule_response(cache, 'simple', queue, days)
     
-    if not result['days']:
-        return jsonify({
-            'error': 'No data available',
-            'message': f'No schedule data found for queue {queue}'
-        }), 404
+    if response is None:
+        return not_available(cache)
     
-    return jsonify(result)
+    # Seconds until the display next needs to wake (see /schedule/next)
+    response.headers['X-Sleep-Hint'] = str(next_wake(cache['responses'], queue, time.time())[3])
+    return response
 
 
-@app.route('/schedule/simple')
+@app.route('/schedule/forecast')
 @require_password
-def get_schedule_simple():
+@with_region
+def get_schedule_forecast(cache):
     """
-    Get simplified schedule data optimized for ESP32 (minimal payload).
+    Get a queue's schedule for the coming days, filling days DTEK has not
+    published yet from its planned weekly schedule (preset).
     
-    Returns compact format: array of status codes for each hour.
-    Status codes: 0=no power, 1=power on, 2=first half off, 3=second half off
+    Each day has `source`: "fact" (published schedule) or "preset" (plan).
+    Status codes are the simple format's, plus 4=possible outage,
+    5=possible outage in the first half, 6=possible outage in the second half.
     
     Query parameters:
     - password: API password (required)
+    - region: DTEK region (default: the first configured one)
     - queue: Queue name (default: GPV3.1)
+    - days: Number of days from today (default: 7, max: 14)
+    """
+    queue = request.args.get('queue', 'GPV3.1')
+    days = number_param(request.args, 'days', '7')
+    
+    response = schedule_response(cache, 'forecast', queue, days)
+    
+    if response is None:
+        return not_available(cache)
+    
+    return response
+
+
+@app.route('/schedule/packed')
+@require_password
+@with_region
+def get_schedule_packed(cache):
+    """
+    Get schedule data bit-packed for the e-ink client (about 20 bytes for 2 days).
+    See PACKED_VERSION in schedule.py for the layout and decode_packed() for a decoder.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - queue: Queue name (default: GPV3.1)
+    - queues: Comma-separated queue names (multi-queue payload, overrides queue, at most 255)
+    - days: Number of days (1 or 2, default: 2)
+    """
+    days = number_param(request.args, 'days', '2')
+    
+    compiled = get_compiled(cache)
+    if compiled is None:
+        return not_available(cache)
+    
+    names = queues_param(request.args)
+    if not names:
+        queue = request.args.get('queue', 'GPV3.1')
+        entry = lookup_response(compiled, 'packed', queue, days)
+    else:
+        entries = [lookup_response(compiled, 'packed', name, days) for name in names]
+        body = encode_packed_multi([(name, entry[1]) for name, entry in zip(names, entries)])
+        etag = hashlib.sha1(''.join(entry[2] for entry in entries).encode('ascii')).hexdigest()[:20]
+        entry = (200, body, etag)
+    
+    return entry_response(cache, compiled, entry, mimetype='application/octet-stream')
+
+
+@app.route('/schedule/batch')
+@require_password
+@with_region
+def get_schedule_batch(cache):
+    """
+    Get several queues in one response: {"queues": {queue: schedule}, "missing": [...]},
+    each schedule as /schedule (or /schedule/simple) would return it.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - queues: Comma-separated queue names (required, at most 255)
+    - days: Number of days (1 or 2, default: 2)
+    - format: full (like /schedule, default) or simple (like /schedule/simple)
+    """
+    compiled = get_compiled(cache)
+    if compiled is None:
+        return not_available(cache)
+    
+    entry = batch_response(compiled, request.args)
+    return entry_response(cache, compiled, entry)
+
+
+@app.route('/schedule/all')
+@require_password
+@with_region
+def get_schedule_all(cache):
+    """
+    Stream every queue as NDJSON, one /schedule (or /schedule/simple) document per line.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
     - days: Number of days (1 or 2, default: 2)
+    - format: full (default) or simple
+    """
+    compiled = get_compiled(cache)
+    if compiled is None:
+        return not_available(cache)
+    
+    endpoint, days = batch_params(request.args)
+    entries, _ = batch_entries(compiled, endpoint, compiled['queues'], days)
+    status, headers, _ = render_entry(cache, compiled, (200, b'', batch_etag(entries)), 'application/x-ndjson',
+                                      request.if_none_match, request.if_modified_since)
+    if status == 304:
+        return app.response_class(b'', status=304, headers=headers)
+    
+    def generate():
+        for _, entry in entries:
+            yield entry[1]  # Compiled bodies already end with a newline
+    
+    return Response(generate(), headers=headers)
+
+
+@app.route('/schedule/stats')
+@require_password
+@with_region
+def get_schedule_stats(cache):
+    """
+    Outage analytics across all queues: hours without power per queue and day,
+    each queue's longest continuous outage and, with `hour`, which queues have
+    power at that hour of each day.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - hour: Hour of the day, 0-23 (optional)
+    """
+    compiled = get_compiled(cache)
+    if compiled is None:
+        return not_available(cache)
+    
+    entry = stats_response(compiled, request.args)
+    return entry_response(cache, compiled, entry)
+
+
+@app.route('/schedule/next')
+@require_password
+@with_region
+def get_schedule_next(cache):
+    """
+    When a queue's power next goes on or off, and how long a battery-powered
+    display can sleep: until that change or the next hour DTEK usually
+    publishes updates in, whichever comes first.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - queue: Queue name (default: GPV3.1)
     """
     queue = request.args.get('queue', 'GPV3.1')
-    days = int(request.args.get('days', '2'))
     
-    data = get_cached_data()
+    compiled = get_compiled(cache)
+    if compiled is None:
+        return not_available(cache)
     
-    if not data:
-        return jsonify({'error': 'Failed to fetch data'}), 500
+    response = jsonify(next_response(compiled, queue))
+    response.headers['Cache-Control'] = 'no-cache'
+    return with_freshness(response, cache)
+
+
+@app.route('/schedule/wait')
+@require_password
+@with_region
+def wait_for_schedule(cache):
+    """
+    Long-poll until a queue's schedule changes.
     
-    fact_json = data['fact']
-    today_timestamp = fact_json.get('today')
-    if not today_timestamp:
-        today = datetime.date.today()
-        today_timestamp = int(time.mktime(today.timetuple()))
-    
-    result = {
-        'q': queue,
-        'd': []
-    }
+    Returns as soon as the queue's change stamp differs from `since`, or after
+    `timeout` seconds with changed=false. Waiters sleep on a condition notified
+    when a new snapshot is compiled, so they cost no CPU; run gunicorn with the
+    gevent worker so each waiter is a greenlet, not a worker.
     
-    status_map = {
-        'yes': 1,
-        'no': 0,
-        'first': 2,
-        'second': 3
-    }
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - queue: Queue name (default: GPV3.1)
+    - since: Last `update` value seen by the client (default: none, returns at once)
+    - timeout: Seconds to wait (default: 60, max: 110)
+    """
+    queue = request.args.get('queue', 'GPV3.1')
+    since = request.args.get('since', '')
+    timeout = min(max(number_param(request.args, 'timeout', '60', float), 0), WAIT_MAX_TIMEOUT)
     
-    for day_offset in range(days):
-        day_timestamp = today_timestamp + (day_offset * 86400)
-        timestamp_str = str(day_timestamp)
-        
-        if timestamp_str in fact_json.get('data', {}):
-            queue_data = fact_json['data'][timestamp_str].get(queue, {})
-            if queue_data:
-                day_schedule = []
-                for hour in range(24):
-                    hour_str = str(hour + 1)
-                    status = queue_data.get(hour_str, 'unknown')
-                    day_schedule.append(status_map.get(status, -1))
-                result['d'].append(day_schedule)
+    start_refresher()
+    deadline = time.time() + timeout
+    with snapshot_changed:
+        while True:
+            update = queue_update(cache, queue)
+            if update is not None and update != since:
+                break
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            snapshot_changed.wait(remaining)
+    
+    return with_freshness(jsonify({
+        'queue': queue,
+        'update': update,
+        'changed': update is not None and update != since
+    }), cache)
+
+
+@app.route('/schedule/changes')
+@require_password
+@with_region
+def get_schedule_changes(cache):
+    """
+    Feed of schedule changes between successive snapshots.
+    
+    Each record lists the hours (0-23) whose status changed, per queue and
+    date timestamp, with their new status (null if the hour disappeared).
+    Pass the returned `seq` as `since` next time to get only newer records.
+    `reset: true` means records after `since` were already dropped, so the
+    consumer should re-download the full schedule.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - since: Last seq seen (default: 0, all retained records)
+    - queue: Only report changes for this queue (optional)
+    """
+    since = number_param(request.args, 'since', '0')
+    queue = request.args.get('queue')
+    
+    get_cached_data(cache)
+    records = [record for record in cache['changes'] if record['seq'] > since]
+    oldest = cache['changes'][0]['seq'] if cache['changes'] else cache['change_seq'] + 1
+    
+    if queue:
+        records = [
+            dict(record, changes={queue: record['changes'][queue]})
+            for record in records if queue in record['changes']
+        ]
+    
+    return with_freshness(jsonify({
+        'seq': cache['change_seq'],
+        'reset': 0 < since < oldest - 1,
+        'changes': records
+    }), cache)
+
+
+def parse_time_param(value, default, end_of_day=False):
+    """A unix timestamp or YYYY-MM-DD date (local time; end_of_day picks its last second)."""
+    if not value:
+        return default
+    if value.isdigit():
+        return int(value)
+    day = datetime.datetime.strptime(value, '%Y-%m-%d')
+    timestamp = int(time.mktime(day.timetuple()))
+    return timestamp + 86399 if end_of_day else timestamp
+
+
+def queue_days(fact_json, queue):
+    """A queue's hours in simple-format status codes, per date timestamp."""
+    days = {}
+    for day, queues in sorted(fact_json.get('data', {}).items()):
+        queue_data = queues.get(queue)
+        if queue_data:
+            days[day] = [STATUS_MAP.get(queue_data.get(str(hour + 1), 'unknown'), -1) for hour in range(24)]
+    return days
+
+
+@app.route('/schedule/history')
+@require_password
+@with_region
+def get_schedule_history(cache):
+    """
+    Stream a queue's archived schedule revisions as NDJSON, oldest first.
+    
+    One line per archived snapshot in which the queue's data changed:
+    {"time": fetch time, "update": DTEK update stamp, "d": {date timestamp: [24 status codes]}}
+    The archive is read lazily, so any time range costs constant memory.
+    
+    Query parameters:
+    - password: API password (required)
+    - region: DTEK region (default: the first configured one)
+    - queue: Queue name (default: GPV3.1)
+    - from: Start, unix timestamp or YYYY-MM-DD (default: 30 days ago)
+    - to: End (inclusive), unix timestamp or YYYY-MM-DD (default: now)
+    """
+    if cache['archive'] is None:
+        return jsonify({'error': 'History archive is disabled'}), 404
+    
+    queue = request.args.get('queue', 'GPV3.1')
+    now = int(time.time())
+    try:
+        start = parse_time_param(request.args.get('from'), now - 30 * 86400)
+        end = parse_time_param(request.args.get('to'), now, end_of_day=True)
+    except ValueError:
+        return jsonify({'error': 'Bad request', 'message': 'from/to must be unix timestamps or YYYY-MM-DD'}), 400
+    
+    def generate():
+        previous = None
+        for timestamp, document in cache['archive'].iter_snapshots(start, end):
+            fact_json = document.get('fact', {})
+            days = queue_days(fact_json, queue)
+            if days != previous:
+                previous = days
+                yield serialize({'time': timestamp, 'update': fact_json.get('update'), 'd': days})
     
-    return jsonify(result)
+    return Response(generate(), mimetype='application/x-ndjson')
 
 
 if __name__ == '__main__':
@@ -394,8 +1541,20 @@ if __name__ == '__main__':
     print("\nEndpoints:")
     print("  GET /schedule?password=xxx&queue=GPV3.1")
     print("  GET /schedule/simple?password=xxx&queue=GPV3.1")
+    print("  GET /schedule/packed?password=xxx&queue=GPV3.1")
+    print("  GET /schedule/forecast?password=xxx&queue=GPV3.1&days=7")
+    print("  GET /schedule/batch?password=xxx&queues=GPV1.1,GPV3.1")
+    print("  GET /schedule/all?password=xxx (NDJSON)")
+    print("  GET /schedule/stats?password=xxx&hour=18")
+    print("  GET /schedule/next?password=xxx&queue=GPV3.1")
+    print("  GET /schedule/wait?password=xxx&queue=GPV3.1&since=UPDATE")
+    print("  GET /schedule/changes?password=xxx&since=SEQ")
+    print("  GET /schedule/history?password=xxx&queue=GPV3.1&from=2025-01-01&to=2025-01-31")
+    print("  GET /metrics (Prometheus)")
+    print(f"\nRegions: {', '.join(REGIONS)} (add &region=NAME, default: {DEFAULT_REGION})")
     print("\nStarting server on http://0.0.0.0:5000")
     print("=" * 60)
     
+    start_refresher()
     app.run(host='0.0.0.0', port=5000, debug=False)
 
@@ -0,0 +1,36 @@
+"""
+Test setup: the server modules are flat files next to this directory, and the
+synthetic DTEK payloads come from benchmarks/fake_dtek.py. The snapshot store
+and archive are pointed away from the real ones before server.py is imported.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.join(SERVER_DIR, 'benchmarks'))
+
+os.environ['SNAPSHOT_DIR'] = tempfile.mkdtemp(prefix='dtek-test-')
+os.environ['ARCHIVE_DIR'] = ''
+
+
+class AliveThread:
+    """Stands in for the background refresher, so tests drive refreshes themselves."""
+
+    def is_alive(self):
+        return True
+
+
+@pytest.fixture
+def leader(monkeypatch):
+    """An empty 'test' region cache in a process that is the refresh leader."""
+    import server
+    monkeypatch.setitem(server.refresher, 'thread', AliveThread())
+    monkeypatch.setitem(server.refresher, 'leader', True)
+    cache = server.new_cache('test', 'http://127.0.0.1:1/ua/shutdowns')
+    monkeypatch.setitem(server.caches, 'test', cache)
+    return cache
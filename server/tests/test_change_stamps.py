@@ -0,0 +1,69 @@
+"""Per-queue change stamps behind /schedule/wait."""
+
+import copy
+
+import server
+from fake_dtek import make_schedule_data
+
+WAIT = '/schedule/wait?password={}&region=test&queue={}&since={}&timeout=1'
+
+
+def refresh_with(monkeypatch, cache, data):
+    monkeypatch.setattr(server, 'fetch_schedule_data', lambda url: copy.deepcopy(data))
+    assert server.refresh_cache(cache)
+
+
+def edited(data, queue, update=None):
+    """A copy of data with one hour of queue flipped, and a new `update` stamp if given."""
+    data = copy.deepcopy(data)
+    hours = data['fact']['data'][str(data['fact']['today'])][queue]
+    hours['5'] = 'yes' if hours['5'] != 'yes' else 'no'
+    if update:
+        data['fact']['update'] = update
+    return data
+
+
+def wait(queue, since):
+    client = server.app.test_client()
+    return client.get(WAIT.format(server.API_PASSWORD, queue, since)).get_json()
+
+
+def test_only_changed_queues_move_to_the_new_update(monkeypatch, leader):
+    data = make_schedule_data(queues=4, update='17.10.2026 10:00')
+    refresh_with(monkeypatch, leader, data)
+    refresh_with(monkeypatch, leader, edited(data, 'GPV1.1', update='17.10.2026 12:00'))
+    
+    assert server.queue_update(leader, 'GPV1.1') == '17.10.2026 12:00'
+    assert server.queue_update(leader, 'GPV2.1') == '17.10.2026 10:00'
+
+
+def test_edit_without_new_update_stamp_wakes_waiters(monkeypatch, leader):
+    data = make_schedule_data(queues=4, update='17.10.2026 10:00')
+    refresh_with(monkeypatch, leader, data)
+    since = server.queue_update(leader, 'GPV1.1')
+    assert since == '17.10.2026 10:00'
+    
+    refresh_with(monkeypatch, leader, edited(data, 'GPV1.1'))
+    
+    result = wait('GPV1.1', since)
+    assert result['changed'] is True
+    assert result['update'].startswith('17.10.2026 10:00#')
+    assert wait('GPV2.1', since)['changed'] is False
+    
+    # A second silent edit moves the stamp again; a repeat of the same data does not
+    stamp = result['update']
+    refresh_with(monkeypatch, leader, edited(edited(data, 'GPV1.1'), 'GPV1.1'))
+    assert server.queue_update(leader, 'GPV1.1') not in (stamp, since)
+    stamp = server.queue_update(leader, 'GPV1.1')
+    refresh_with(monkeypatch, leader, edited(edited(data, 'GPV1.1'), 'GPV1.1'))
+    assert server.queue_update(leader, 'GPV1.1') == stamp
+
+
+def test_readers_take_the_stamps_from_the_snapshot(monkeypatch, leader):
+    data = make_schedule_data(queues=4, update='17.10.2026 10:00')
+    refresh_with(monkeypatch, leader, data)
+    refresh_with(monkeypatch, leader, edited(data, 'GPV1.1'))
+    
+    reader = server.new_cache('test', leader['url'])
+    assert server.load_snapshot(reader)
+    assert reader['responses']['queue_updates'] == leader['responses']['queue_updates']
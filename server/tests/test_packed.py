@@ -0,0 +1,102 @@
+"""Round trips of the packed format (/schedule/packed) against the simple format's codes."""
+
+import pytest
+
+from fake_dtek import make_schedule_data, queue_names
+from schedule import (PACKED_FLAG_MULTI, PACKED_UNKNOWN, PACKED_VERSION, STATUS_MAP, build_schedule_simple, crc8, decode_packed,
+                      encode_packed, encode_packed_multi, pack_days)
+
+QUEUES = queue_names(12)
+
+
+@pytest.fixture(scope='module')
+def fact_json():
+    return make_schedule_data(queues=len(QUEUES), days=2)['fact']
+
+
+@pytest.mark.parametrize('days', [0, 1, 2, 3])
+@pytest.mark.parametrize('queue', QUEUES)
+def test_single_queue_round_trip(fact_json, queue, days):
+    simple, _ = build_schedule_simple(fact_json, queue, days)
+    decoded = decode_packed(encode_packed(fact_json, queue, days))
+    assert decoded == {'version': PACKED_VERSION, 'days': simple['d']}
+
+
+def test_every_status_round_trips(fact_json):
+    day = str(fact_json['today'])
+    statuses = list(STATUS_MAP) + ['maybe', None]
+    fact_json = dict(fact_json, data={day: {'GPV1.1': {
+        str(hour + 1): statuses[hour % len(statuses)] for hour in range(24)
+    }}})
+    simple, _ = build_schedule_simple(fact_json, 'GPV1.1', 1)
+    assert decode_packed(encode_packed(fact_json, 'GPV1.1', 1))['days'] == simple['d']
+    assert set(simple['d'][0]) == set(STATUS_MAP.values()) | {-1}
+
+
+def test_unknown_is_packed_as_7_and_decoded_as_minus_1():
+    packed = pack_days([[-1] * 24])
+    assert packed[0] == 1
+    bits = int.from_bytes(packed[1:], 'little')
+    assert [(bits >> (3 * hour)) & 0x07 for hour in range(24)] == [PACKED_UNKNOWN] * 24
+    
+    body = bytes([PACKED_VERSION << 4]) + packed
+    assert decode_packed(body + bytes([crc8(body)]))['days'] == [[-1] * 24]
+
+
+def test_queue_without_data_decodes_to_no_days(fact_json):
+    assert decode_packed(encode_packed(fact_json, 'GPV99.1', 2))['days'] == []
+
+
+def test_multi_queue_round_trip(fact_json):
+    names = QUEUES[:5] + ['GPV99.1']
+    bodies = [(name, encode_packed(fact_json, name, 2)) for name in names]
+    decoded = decode_packed(encode_packed_multi(bodies))
+    assert decoded['version'] == PACKED_VERSION
+    assert list(decoded['queues']) == names
+    for name in names:
+        assert decoded['queues'][name] == build_schedule_simple(fact_json, name, 2)[0]['d']
+
+
+def test_two_days_fit_in_about_20_bytes(fact_json):
+    assert len(encode_packed(fact_json, 'GPV3.1', 2)) == 21
+
+
+@pytest.mark.parametrize('index', [0, 1, 5, -1])
+def test_corrupted_byte_is_rejected(fact_json, index):
+    data = bytearray(encode_packed(fact_json, 'GPV3.1', 2))
+    data[index] ^= 0x10
+    with pytest.raises(ValueError, match='CRC'):
+        decode_packed(bytes(data))
+
+
+def test_truncated_payload_is_rejected(fact_json):
+    data = encode_packed(fact_json, 'GPV3.1', 2)
+    body = data[:-5]
+    with pytest.raises(ValueError):
+        decode_packed(body + bytes([crc8(body)]))
+    with pytest.raises(ValueError):
+        decode_packed(data[:2])
+
+
+@pytest.mark.parametrize('cut', [1, 2, 3, 8, 20])
+def test_truncated_multi_queue_payload_is_rejected(fact_json, cut):
+    data = encode_packed_multi([(name, encode_packed(fact_json, name, 2)) for name in QUEUES[:3]])
+    body = data[:-1][:-cut]
+    with pytest.raises(ValueError, match='Truncated'):
+        decode_packed(body + bytes([crc8(body)]))
+
+
+@pytest.mark.parametrize('body', [
+    bytes([PACKED_VERSION << 4 | PACKED_FLAG_MULTI, 3]),
+    bytes([PACKED_VERSION << 4 | PACKED_FLAG_MULTI, 1, 6]) + b'GPV',
+])
+def test_multi_queue_header_without_queues_is_rejected(body):
+    with pytest.raises(ValueError, match='Truncated'):
+        decode_packed(body + bytes([crc8(body)]))
+
+
+def test_unknown_version_is_rejected(fact_json):
+    data = encode_packed(fact_json, 'GPV3.1', 2)
+    body = bytes([(PACKED_VERSION + 1) << 4]) + data[1:-1]
+    with pytest.raises(ValueError, match='version'):
+        decode_packed(body + bytes([crc8(body)]))
@@ -0,0 +1,74 @@
+"""Invalid query parameters get the same 400 in Flask and ASGI mode."""
+
+import asyncio
+
+import pytest
+
+import asgi
+import server
+from fake_dtek import make_schedule_data, queue_names
+
+TOO_MANY_QUEUES = 'queues=' + ','.join(queue_names(server.BATCH_MAX_QUEUES + 1))
+INVALID = [
+    ('/schedule', 'days=abc'),
+    ('/schedule', 'days='),
+    ('/schedule/simple', 'days=1.5'),
+    ('/schedule/forecast', 'days=x'),
+    ('/schedule/packed', 'days=x'),
+    ('/schedule/batch', 'queues=GPV3.1&days=x'),
+    ('/schedule/batch', 'format=xml&queues=GPV3.1'),
+    ('/schedule/batch', 'queues=,'),
+    ('/schedule/batch', TOO_MANY_QUEUES),
+    ('/schedule/packed', TOO_MANY_QUEUES),
+    ('/schedule/all', 'days=x'),
+    ('/schedule/stats', 'hour=x'),
+    ('/schedule/stats', 'hour=30'),
+    ('/schedule/stats', 'hour='),
+    ('/schedule/wait', 'timeout=nan'),
+]
+
+
+@pytest.fixture
+def compiled(monkeypatch, leader):
+    monkeypatch.setattr(server, 'fetch_schedule_data', lambda url: make_schedule_data(queues=4))
+    assert server.refresh_cache(leader)
+    return leader
+
+
+def query(qs):
+    return f'password={server.API_PASSWORD}&region=test&{qs}'
+
+
+async def call_asgi(path, qs):
+    messages = []
+    
+    async def receive():
+        return {'type': 'http.request'}
+    
+    async def send(message):
+        messages.append(message)
+    
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'root_path': '',
+             'path': path, 'query_string': qs.encode(), 'headers': [], 'server': ('testserver', 80)}
+    await asgi.app(scope, receive, send)
+    return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+
+@pytest.mark.parametrize('path,qs', INVALID, ids=lambda value: value[:40])
+def test_invalid_parameter_is_the_same_400_in_both_modes(compiled, path, qs):
+    response = server.app.test_client().get(f'{path}?{query(qs)}')
+    
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Bad request'
+    assert asyncio.run(call_asgi(path, query(qs))) == (400, response.data)
+
+
+def test_other_value_errors_are_not_blamed_on_the_client(monkeypatch, compiled):
+    def broken(compiled, args):
+        raise ValueError('not a parameter problem')
+    
+    monkeypatch.setattr(server, 'stats_response', broken)
+    
+    assert server.app.test_client().get(f'/schedule/stats?{query("")}').status_code == 500
+    with pytest.raises(ValueError):
+        asyncio.run(call_asgi('/schedule/stats', query('')))
@@ -0,0 +1,30 @@
+"""DisconSchedule extraction from the page as it arrives off the wire."""
+
+import pytest
+
+from fake_dtek import make_schedule_data, render_page
+from schedule import decode_chunks, parse_discon_schedule
+
+
+def byte_chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 13, 333, 16384])
+def test_cyrillic_split_across_chunks_round_trips(size):
+    data = make_schedule_data(queues=4)
+    page = render_page(data).encode('utf-8')
+    
+    preset, fact = parse_discon_schedule(decode_chunks(byte_chunks(page, size)))
+    
+    assert preset == data['preset']
+    assert fact == data['fact']
+    assert '�' not in repr(preset)
+
+
+def test_decode_chunks_keeps_split_characters_whole():
+    text = 'Світла немає'
+    encoded = text.encode('utf-8')
+    assert ''.join(decode_chunks(byte_chunks(encoded, 1))) == text
+    # A truncated character at the very end still comes out as a replacement
+    assert ''.join(decode_chunks([encoded[:-1]])) == text[:-1] + '�'
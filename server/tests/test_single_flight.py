@@ -0,0 +1,73 @@
+"""Concurrent cache misses share one fetch (get_cached_data / SingleFlight)."""
+
+import threading
+import time
+
+import server
+from fake_dtek import make_schedule_data
+
+
+def counting_fetcher(monkeypatch, delay, data):
+    """Patch in a slow fake fetcher; returns the list its calls are recorded in."""
+    calls = []
+    
+    def fetch(url):
+        calls.append(url)
+        time.sleep(delay)
+        return data
+    
+    monkeypatch.setattr(server, 'fetch_schedule_data', fetch)
+    return calls
+
+
+def run_concurrently(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    
+    def worker(i):
+        barrier.wait()
+        results[i] = target()
+    
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_misses_fetch_once(monkeypatch, leader):
+    data = make_schedule_data(queues=4)
+    calls = counting_fetcher(monkeypatch, 0.3, data)
+    
+    results = run_concurrently(20, lambda: server.get_cached_data(leader))
+    
+    assert len(calls) == 1
+    assert all(result is data for result in results)
+    assert leader['generation'] == 1
+
+
+def test_waiters_give_up_after_miss_wait(monkeypatch, leader):
+    leader['miss_wait'] = 0.2
+    calls = counting_fetcher(monkeypatch, 1.0, make_schedule_data(queues=4))
+    
+    started = time.time()
+    results = run_concurrently(5, lambda: server.get_cached_data(leader))
+    
+    assert time.time() - started < 0.9
+    assert results == [None] * 5
+    assert len(calls) == 1
+
+
+def test_single_flight_runs_one_call_per_key():
+    flight = server.SingleFlight()
+    calls = []
+    
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return len(calls)
+    
+    results = run_concurrently(10, lambda: flight.do('key', slow, timeout=5))
+    assert results == [1] * 10
+    assert flight.do('key', slow, timeout=5) == 2  # The next call after the flight landed runs again